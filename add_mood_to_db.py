@@ -1,71 +1,480 @@
 import sqlite3
-from datetime import datetime
+import sys
+import time
+from collections import Counter
+from itertools import islice
+
+from mood_archive import archived_monthly_counts, iter_all_archived, iter_archived, read_snapshot
+from mood_time import MSK_UTC_OFFSET, local_year_month, parse_legacy_timestamp
+
+# Версия схемы mood_base.db (PRAGMA user_version): 2 - время записей хранится в секундах UTC (колонка ts)
+MOODS_SCHEMA_VERSION = 2
+
+# Версии данных по месяцам: {(user_id, год, месяц): версия}. Увеличиваются при каждой новой записи,
+# поэтому закэшированный по версии график месяца становится недействительным сам собой.
+# Для графиков за всю историю есть общая версия пользователя {user_id: версия}
+_data_versions = {}
+_user_data_versions = {}
+
+def get_data_version(user_id: int, year: int, month: int) -> int:
+    return _data_versions.get((user_id, year, month), 0)
+
+def get_user_data_version(user_id: int) -> int:
+    return _user_data_versions.get(user_id, 0)
+
+def bump_data_version(user_id: int, year: int, month: int):
+    key = (user_id, year, month)
+    _data_versions[key] = _data_versions.get(key, 0) + 1
+    _user_data_versions[user_id] = _user_data_versions.get(user_id, 0) + 1
 
 # Функция для подключения к базе данных
 def connect_db(db_name='mood_base.db'):
     conn = sqlite3.connect(db_name, check_same_thread=False)
     return conn
 
-# Функция для создания таблицы, если ее еще нет
-def create_table(conn):
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS moods (
+def get_schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def get_table_columns(conn, table: str) -> list:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def _create_legacy_moods_table(conn, name: str):
+    # Схема версии 2 для переноса старой базы: ts - время записи в секундах UTC, подпись mood ещё хранится
+    # в каждой записи. Колонку mood убирает миграция 3 из migrations.py
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             mood TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
+            ts INTEGER NOT NULL,
             mood_id INTEGER NOT NULL
         )
     ''')
+
+# Функция для создания таблицы, если ее еще нет. Схему базы создают и обновляют миграции из migrations.py
+def create_table(conn):
+    cursor = conn.cursor()
+    # Базу со старой схемой (timestamp TEXT) не трогаем: её переводит migrate_timestamps.
+    # Новая база сразу получает итоговую схему moods: подписи настроений берутся из mood_catalog
+    if not get_table_columns(conn, 'moods'):
+        cursor.execute('''
+            CREATE TABLE moods (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                mood_id INTEGER NOT NULL REFERENCES mood_catalog (id)
+            )
+        ''')
+        cursor.execute(f'PRAGMA user_version = {MOODS_SCHEMA_VERSION}')
+    # Счётчики настроений по месяцам, которые обновляются вместе с каждой новой записью
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mood_monthly_counts (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            mood_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, year, month, mood_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+# Функция для создания индексов, по которым строятся выборки по пользователю и времени
+def create_indexes(conn):
+    cursor = conn.cursor()
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_moods_user_ts ON moods (user_id, ts)')
     conn.commit()
 
 # Функция для добавления записи о настроении
-def add_mood(conn, user_id, mood, mood_id):
+def add_mood(conn, user_id, mood_id, utc_offset=MSK_UTC_OFFSET):
+    add_moods_batch(conn, [(user_id, mood_id, int(time.time()), utc_offset)])
+
+# Функция для добавления пачки записей о настроении одной транзакцией
+def add_moods_batch(conn, rows: list):
+    """rows - список кортежей (user_id, mood_id, ts, utc_offset), ts - секунды UTC.
+    utc_offset - смещение пользователя от UTC в секундах: по нему запись относится к месяцу
+    в счётчиках mood_monthly_counts, которые обновляются в той же транзакции"""
+    monthly = Counter(
+        (user_id,) + local_year_month(ts, utc_offset) + (mood_id,)
+        for user_id, mood_id, ts, utc_offset in rows
+    )
+    with conn:
+        conn.executemany('''
+            INSERT INTO moods (user_id, mood_id, ts)
+            VALUES (?, ?, ?)
+        ''', [row[:3] for row in rows])
+        conn.executemany('''
+            INSERT INTO mood_monthly_counts (user_id, year, month, mood_id, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, year, month, mood_id) DO UPDATE SET count = count + excluded.count
+        ''', [key + (count,) for key, count in monthly.items()])
+    for user_id, year, month, _ in monthly:
+        bump_data_version(user_id, year, month)
+
+# Функция для создания таблицы настроек пользователей
+def create_users_table(conn):
     cursor = conn.cursor()
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # notification_time - время напоминания по Москве 'ЧЧ:ММ', time_zone - смещение относительно МСК в часах,
+    # notification_seq - номер последнего изменения notification_time (см. get_notification_changes)
     cursor.execute('''
-        INSERT INTO moods (user_id, mood, timestamp, mood_id)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, mood, timestamp, mood_id))
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            notification_time TEXT,
+            time_zone INTEGER,
+            notification_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    create_notification_seq_index(conn)
     conn.commit()
 
-def add_user_notification(conn, time: str, user_id: int, time_zone="0"):
+def create_notification_seq_index(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_notification_seq ON users (notification_seq)')
+
+# Следующий номер изменения времени напоминания. Запись в SQLite идёт по одной транзакции, поэтому номера
+# растут в порядке фиксации изменений, даже когда их пишут несколько процессов
+NEXT_NOTIFICATION_SEQ = '(SELECT COALESCE(MAX(notification_seq), 0) + 1 FROM users)'
+
+def get_all_notifications(conn) -> list:
+    """Возвращает пары (user_id, notification_time) всех пользователей с настроенным напоминанием"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT user_id, notification_time FROM users WHERE notification_time IS NOT NULL')
+    return cursor.fetchall()
+
+def get_notification_seq(conn) -> int:
+    """Номер последнего изменения времени напоминаний"""
+    return conn.execute('SELECT COALESCE(MAX(notification_seq), 0) FROM users').fetchone()[0]
+
+def get_notification_changes(conn, after_seq: int) -> list:
+    """Изменения времени напоминаний после after_seq по порядку: (user_id, notification_time, notification_seq).
+    notification_time None - напоминание отключено"""
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO users (user_id, notification_time, time_zone)
-        VALUES (?, ?, ?)
+        SELECT user_id, notification_time, notification_seq FROM users
+        WHERE notification_seq > ? ORDER BY notification_seq
+    ''', (after_seq,))
+    return cursor.fetchall()
+
+def get_user_settings(conn, user_id: int):
+    """Возвращает (notification_time, time_zone) пользователя или None, если его нет в таблице"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT notification_time, time_zone FROM users WHERE user_id = ?', (user_id,))
+    return cursor.fetchone()
+
+def add_user_notification(conn, time: str, user_id: int, time_zone=0):
+    """Добавляет строку пользователя. Если её уже добавил параллельный обработчик (выбор часового пояса,
+    пока сохраняется время напоминания), переданные значения дописываются в неё, а None не затирает
+    сохранённое"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        INSERT INTO users (user_id, notification_time, time_zone, notification_seq)
+        VALUES (?, ?, ?, {NEXT_NOTIFICATION_SEQ})
+        ON CONFLICT (user_id) DO UPDATE SET
+            notification_time = COALESCE(excluded.notification_time, notification_time),
+            time_zone = COALESCE(excluded.time_zone, time_zone),
+            notification_seq = CASE WHEN excluded.notification_time IS NULL THEN notification_seq
+                                    ELSE excluded.notification_seq END
     ''', (user_id, time, time_zone))
     conn.commit()
 
-def check_user_in_table(conn, user_id: int):
+def check_user_in_table(conn, user_id: int) -> bool:
     cursor = conn.cursor()
-    cursor.execute('SELECT user_id, notification_time, time_zone FROM users')
-    rows = cursor.fetchall()
-    users_list = []
-    if rows == []:
-        return False
-    else: 
-        for i in rows:
-            users_list.append(i[0])
-    return users_list
+    cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+    return cursor.fetchone() is not None
 
 
+def get_mood_labels(conn) -> dict:
+    return dict(conn.execute('SELECT id, label FROM mood_catalog'))
+
 def get_all_moods(conn):
     cursor = conn.cursor()
-    cursor.execute('SELECT user_id, mood, timestamp, mood_id FROM moods')
-    rows = cursor.fetchall()
+    with read_snapshot(conn):
+        cursor.execute('''
+            SELECT moods.user_id, mood_catalog.label, moods.ts, moods.mood_id
+            FROM moods JOIN mood_catalog ON mood_catalog.id = moods.mood_id
+        ''')
+        rows = cursor.fetchall()
+        labels = get_mood_labels(conn)
+        rows += [(user_id, labels[mood_id], ts, mood_id) for user_id, _, ts, mood_id in iter_all_archived(conn)]
     return rows
 
+def get_month_mood_counts(conn, user_id: int, year: int, month: int) -> dict:
+    """Возвращает количество записей каждого настроения пользователя за месяц в виде {mood_id: count}"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT mood_id, count FROM mood_monthly_counts
+        WHERE user_id = ? AND year = ? AND month = ?
+    ''', (user_id, year, month))
+    return dict(cursor.fetchall())
+
+def get_available_year_months(conn, user_id: int) -> list:
+    """Возвращает отсортированный список пар (год, месяц), в которых у пользователя есть записи"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DISTINCT year, month FROM mood_monthly_counts
+        WHERE user_id = ? ORDER BY year, month
+    ''', (user_id,))
+    return cursor.fetchall()
+
+def get_mood_history_page(conn, user_id: int, cursor_id=None, direction="older", limit: int = 30,
+                          cursor_ts=None) -> list:
+    """Возвращает страницу истории пользователя от новых записей к старым.
+
+    Строки - кортежи (id, подпись настроения, ts, mood_id). cursor_id и cursor_ts - id и время граничной
+    записи предыдущей страницы: при direction="older" берутся записи старше неё, при direction="newer" - новее.
+    Страница ищется по индексу (user_id, ts), поэтому любая страница стоит как первая; записи из архива
+    (mood_archive.py) читаются только из блоков месяцев, до которых дошла страница. Без cursor_ts
+    (кнопки старых сообщений) время ищется по id только в moods.
+    """
+    select = '''
+        SELECT moods.id, mood_catalog.label, moods.ts, moods.mood_id
+        FROM moods JOIN mood_catalog ON mood_catalog.id = moods.mood_id
+    '''
+    cursor = conn.cursor()
+    with read_snapshot(conn):
+        if cursor_id is None:
+            cursor.execute(select + '''
+                WHERE moods.user_id = ?
+                ORDER BY moods.ts DESC, moods.id DESC LIMIT ?
+            ''', (user_id, limit))
+            rows = cursor.fetchall()
+            archived = iter_archived(conn, user_id, newest_first=True)
+            return _merge_history_page(conn, rows, archived, limit, newest_first=True)
+
+        if cursor_ts is not None:
+            boundary = (cursor_ts, cursor_id)
+        else:
+            boundary = conn.execute('SELECT ts, id FROM moods WHERE id = ? AND user_id = ?', (cursor_id, user_id)).fetchone()
+            if boundary is None:
+                return []
+
+        if direction == "older":
+            cursor.execute(select + '''
+                WHERE moods.user_id = ? AND (moods.ts, moods.id) < (?, ?)
+                ORDER BY moods.ts DESC, moods.id DESC LIMIT ?
+            ''', (user_id, *boundary, limit))
+            rows = cursor.fetchall()
+            archived = (row for row in iter_archived(conn, user_id, end_ts=boundary[0] + 1, newest_first=True)
+                        if (row[1], row[0]) < boundary)
+            return _merge_history_page(conn, rows, archived, limit, newest_first=True)
+
+        cursor.execute(select + '''
+            WHERE moods.user_id = ? AND (moods.ts, moods.id) > (?, ?)
+            ORDER BY moods.ts ASC, moods.id ASC LIMIT ?
+        ''', (user_id, *boundary, limit))
+        rows = cursor.fetchall()
+        archived = (row for row in iter_archived(conn, user_id, start_ts=boundary[0]) if (row[1], row[0]) > boundary)
+        return _merge_history_page(conn, rows, archived, limit, newest_first=False)[::-1]
+
+def _merge_history_page(conn, rows: list, archived, limit: int, newest_first: bool) -> list:
+    # Записи, импортированные задним числом, лежат в moods рядом с архивными месяцами, поэтому страница
+    # собирается из обеих частей. archived уже упорядочены как нужно, из них берётся не больше limit
+    archived = list(islice(archived, limit))
+    if not archived:
+        return rows
+    labels = get_mood_labels(conn)
+    rows = rows + [(id_, labels[mood_id], ts, mood_id) for id_, ts, mood_id in archived]
+    rows.sort(key=lambda row: (row[2], row[0]), reverse=newest_first)
+    return rows[:limit]
+
+def count_user_moods(conn, user_id: int) -> int:
+    """Количество записей пользователя (сумма месячных счётчиков, без чтения самих записей)"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT COALESCE(SUM(count), 0) FROM mood_monthly_counts WHERE user_id = ?', (user_id,))
+    return cursor.fetchone()[0]
+
+# --- Обслуживание таблицы mood_monthly_counts ---
+# Местный месяц записи: ts сдвигается на часовой пояс пользователя из users (по умолчанию МСК)
+_LOCAL_MONTH_SQL = f'''
+    SELECT moods.user_id,
+           CAST(strftime('%Y', ts + {MSK_UTC_OFFSET} + COALESCE(users.time_zone, 0) * 3600, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', ts + {MSK_UTC_OFFSET} + COALESCE(users.time_zone, 0) * 3600, 'unixepoch') AS INTEGER),
+           mood_id, COUNT(*)
+    FROM moods LEFT JOIN users ON users.user_id = moods.user_id
+    GROUP BY 1, 2, 3, 4
+'''
+
+def _count_raw_monthly(conn) -> dict:
+    cursor = conn.cursor()
+    cursor.execute(_LOCAL_MONTH_SQL)
+    counts = Counter({row[:4]: row[4] for row in cursor})
+    counts.update(archived_monthly_counts(conn))
+    return dict(counts)
+
+def _add_monthly_counts(conn, counts: Counter):
+    # Записи из архива добавляются к счётчикам, уже посчитанным по moods
+    conn.executemany('''
+        INSERT INTO mood_monthly_counts (user_id, year, month, mood_id, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, year, month, mood_id) DO UPDATE SET count = count + excluded.count
+    ''', [key + (count,) for key, count in counts.items()])
+
+def _rebuild_monthly_counts(conn):
+    # Выполняется внутри транзакции вызывающего
+    conn.execute('DELETE FROM mood_monthly_counts')
+    conn.execute('INSERT INTO mood_monthly_counts (user_id, year, month, mood_id, count) ' + _LOCAL_MONTH_SQL)
+    _add_monthly_counts(conn, archived_monthly_counts(conn))
+
+def backfill_monthly_counts(conn) -> int:
+    """Заново строит mood_monthly_counts по всем записям moods. Возвращает число строк счётчиков"""
+    with conn:
+        _rebuild_monthly_counts(conn)
+    return conn.execute('SELECT COUNT(*) FROM mood_monthly_counts').fetchone()[0]
+
+def _rebuild_user_monthly_counts(conn, user_id: int, utc_offset: int) -> set:
+    # Выполняется внутри транзакции вызывающего. Возвращает месяцы, счётчики которых могли измениться
+    old_months = set(get_available_year_months(conn, user_id))
+    conn.execute('DELETE FROM mood_monthly_counts WHERE user_id = ?', (user_id,))
+    conn.execute('''
+        INSERT INTO mood_monthly_counts (user_id, year, month, mood_id, count)
+        SELECT user_id,
+               CAST(strftime('%Y', ts + ?, 'unixepoch') AS INTEGER),
+               CAST(strftime('%m', ts + ?, 'unixepoch') AS INTEGER),
+               mood_id, COUNT(*)
+        FROM moods WHERE user_id = ? GROUP BY 1, 2, 3, 4
+    ''', (utc_offset, utc_offset, user_id))
+    _add_monthly_counts(conn, archived_monthly_counts(conn, user_id, utc_offset))
+    return old_months | set(get_available_year_months(conn, user_id))
+
+def rebuild_user_monthly_counts(conn, user_id: int, utc_offset: int):
+    """Пересчитывает месячные счётчики пользователя после смены часового пояса.
+    Записи пользователя читаются по индексу (user_id, ts)"""
+    with conn:
+        months = _rebuild_user_monthly_counts(conn, user_id, utc_offset)
+    for year, month in months:
+        bump_data_version(user_id, year, month)
+
+def ensure_monthly_counts(conn):
+    """Заполняет счётчики, если таблица только что появилась в базе с уже существующими записями"""
+    has_counts = conn.execute('SELECT 1 FROM mood_monthly_counts LIMIT 1').fetchone()
+    has_moods = conn.execute('SELECT 1 FROM moods LIMIT 1').fetchone()
+    if has_moods and not has_counts:
+        backfill_monthly_counts(conn)
+
+def check_monthly_counts(conn) -> list:
+    """Сверяет mood_monthly_counts с таблицей moods.
+    Возвращает расхождения в виде [(user_id, year, month, mood_id, по moods, по счётчикам)]"""
+    raw = _count_raw_monthly(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT user_id, year, month, mood_id, count FROM mood_monthly_counts')
+    rollup = {row[:4]: row[4] for row in cursor}
+    mismatches = []
+    for key in sorted(raw.keys() | rollup.keys()):
+        if raw.get(key, 0) != rollup.get(key, 0):
+            mismatches.append(key + (raw.get(key, 0), rollup.get(key, 0)))
+    return mismatches
+
+# --- file_id отправленных графиков ---
+# Telegram хранит отправленные фото, и повторная отправка по file_id обходится без отрисовки и загрузки.
+# Вместе с file_id хранится версия данных - счётчики месяца, по которым рисовался график. Новая запись
+# (или пересчёт месяца после смены часового пояса, импорт) меняет счётчики, и сохранённый file_id
+# перестаёт подходить; в отличие от _data_versions, такая версия переживает перезапуск бота
+def create_chart_files_table(conn):
+    cursor = conn.cursor()
+    # variant - движок отрисовки и формат изображения, например 'pillow.png'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chart_files (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            variant TEXT NOT NULL,
+            data_version TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, year, month, variant)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+def month_counts_version(mood_counts: dict) -> str:
+    return ",".join(f"{mood_id}:{count}" for mood_id, count in sorted(mood_counts.items()))
+
+def get_month_chart_file(conn, user_id: int, year: int, month: int, variant: str) -> tuple:
+    """Возвращает (счётчики месяца {mood_id: count}, file_id или None).
+    file_id возвращается, только если график отправлялся по тем же счётчикам"""
+    mood_counts = get_month_mood_counts(conn, user_id, year, month)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT data_version, file_id FROM chart_files
+        WHERE user_id = ? AND year = ? AND month = ? AND variant = ?
+    ''', (user_id, year, month, variant))
+    row = cursor.fetchone()
+    if row is None or row[0] != month_counts_version(mood_counts):
+        return mood_counts, None
+    return mood_counts, row[1]
+
+def save_chart_file(conn, user_id: int, year: int, month: int, variant: str, data_version: str, file_id: str):
+    with conn:
+        conn.execute('''
+            INSERT INTO chart_files (user_id, year, month, variant, data_version, file_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, year, month, variant)
+            DO UPDATE SET data_version = excluded.data_version, file_id = excluded.file_id
+        ''', (user_id, year, month, variant, data_version, file_id))
+
+# --- Перевод базы на время в секундах UTC ---
+def migrate_timestamps(conn, chunk_size: int = 5000, source_utc_offset=None, progress=None) -> int:
+    """Переводит moods со строкового времени сервера (timestamp TEXT) на секунды UTC (ts INTEGER).
+
+    Записи копируются в moods_v2 пачками по chunk_size, каждая пачка - отдельная транзакция,
+    поэтому прерванную миграцию можно просто запустить снова: она продолжит с последнего id в moods_v2.
+    В конце одной транзакцией старая таблица заменяется новой, пересобираются индекс и месячные
+    счётчики (в часовых поясах пользователей из users), а user_version становится MOODS_SCHEMA_VERSION.
+    source_utc_offset - смещение сервера, на котором писались старые записи (по умолчанию - текущего).
+    Возвращает число перенесённых записей.
+    """
+    if get_schema_version(conn) >= MOODS_SCHEMA_VERSION or 'timestamp' not in get_table_columns(conn, 'moods'):
+        return 0
+
+    _create_legacy_moods_table(conn, 'moods_v2')
+    conn.commit()
+    migrated = conn.execute('SELECT COUNT(*) FROM moods_v2').fetchone()[0]
+    while True:
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM moods_v2').fetchone()[0]
+        rows = conn.execute(
+            'SELECT id, user_id, mood, timestamp, mood_id FROM moods WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        with conn:
+            conn.executemany(
+                'INSERT INTO moods_v2 (id, user_id, mood, ts, mood_id) VALUES (?, ?, ?, ?, ?)',
+                [(id_, user_id, mood, parse_legacy_timestamp(timestamp, source_utc_offset), mood_id)
+                 for id_, user_id, mood, timestamp, mood_id in rows]
+            )
+        migrated += len(rows)
+        if progress is not None:
+            progress(migrated)
+
+    # DDL в sqlite3 по умолчанию выполняется вне транзакции, поэтому замена таблицы открывается явно
+    conn.execute('BEGIN')
+    try:
+        conn.execute('DROP TABLE moods')
+        conn.execute('ALTER TABLE moods_v2 RENAME TO moods')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_moods_user_ts ON moods (user_id, ts)')
+        _rebuild_monthly_counts(conn)
+        conn.execute(f'PRAGMA user_version = {MOODS_SCHEMA_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return migrated
+
 def update_time_notification(conn, user_id, new_time: str):
     cursor = conn.cursor()
     cursor.execute(
-        'UPDATE users SET notification_time = ? WHERE user_id = ?',
+        f'UPDATE users SET notification_time = ?, notification_seq = {NEXT_NOTIFICATION_SEQ} WHERE user_id = ?',
         (new_time, user_id)
     )
     conn.commit()
 
-def update_time_zone(conn, user_id, new_timezone: str):
+def clear_time_notification(conn, user_id):
+    """Отключает напоминания пользователя, не удаляя его настройки"""
+    cursor = conn.cursor()
+    cursor.execute(f'UPDATE users SET notification_time = NULL, notification_seq = {NEXT_NOTIFICATION_SEQ} WHERE user_id = ?',
+                   (user_id,))
+    conn.commit()
+
+def update_time_zone(conn, user_id, new_timezone: int):
     cursor = conn.cursor()
     cursor.execute(
         'UPDATE users SET time_zone = ? WHERE user_id = ?',
@@ -76,7 +485,26 @@ def update_time_zone(conn, user_id, new_timezone: str):
 def get_time_zone(conn, user_id: int):
     """Извлекает значения врмеенного пояса пользователя"""
     cursor = conn.cursor()
-    cursor.execute('SELECT user_id, notification_time, time_zone FROM users')
-    rows = cursor.fetchall()
-    for i in rows:
-        if i[0] == user_id: return i[2]
\ No newline at end of file
+    cursor.execute('SELECT time_zone FROM users WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+if __name__ == '__main__':
+    # python add_mood_to_db.py backfill [база] - пересобрать месячные счётчики
+    # python add_mood_to_db.py check [база]    - проверить счётчики по сырым записям
+    # Схему базы обновляет python migrations.py [база]
+    if len(sys.argv) < 2 or sys.argv[1] not in ("backfill", "check"):
+        print("Использование: python add_mood_to_db.py backfill|check [mood_base.db]")
+        sys.exit(2)
+    conn = connect_db(sys.argv[2] if len(sys.argv) > 2 else 'mood_base.db')
+    if sys.argv[1] == "backfill":
+        print(f"Готово, строк в mood_monthly_counts: {backfill_monthly_counts(conn)}")
+    else:
+        mismatches = check_monthly_counts(conn)
+        for mismatch in mismatches:
+            print("user_id={} {}-{:02d} mood_id={}: в moods {}, в счётчиках {}".format(*mismatch))
+        print("Расхождений нет" if not mismatches else f"Расхождений: {len(mismatches)}")
+        conn.close()
+        sys.exit(1 if mismatches else 0)
+    conn.close()
@@ -0,0 +1,96 @@
+import asyncio
+import functools
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+
+class AsyncDatabase:
+    """Неблокирующий доступ к базе SQLite для асинхронных обработчиков.
+
+    Синхронные функции из add_mood_to_db выполняются в отдельных потоках:
+    все записи идут через одно соединение-писатель в собственном потоке,
+    чтения - через небольшой пул соединений-читателей. База переводится в режим WAL,
+    поэтому читатели не ждут, пока писатель закончит транзакцию.
+
+    Пример:
+        db = AsyncDatabase('mood_base.db')
+        await db.write(add_mood, user_id, mood_id, utc_offset=MSK_UTC_OFFSET)
+        rows = await db.read(get_all_moods)
+    """
+
+    def __init__(self, db_name='mood_base.db', readers: int = 4, busy_timeout: float = 5.0):
+        self.db_name = db_name
+        self.busy_timeout = busy_timeout
+        self._writer_conn = None
+        self._reader_conns = queue.Queue()
+        self._all_conns = []
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-writer-{db_name}")
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix=f"db-reader-{db_name}")
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(self.db_name, timeout=self.busy_timeout, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL достаточно NORMAL: fsync выполняется на контрольных точках, а не на каждый commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if read_only:
+            conn.execute('PRAGMA query_only=ON')
+        self._all_conns.append(conn)
+        return conn
+
+    def _run_write(self, func, args, kwargs):
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        conn = self._writer_conn
+        started = time.perf_counter()
+        try:
+            return func(conn, *args, **kwargs)
+        except Exception:
+            # Незавершённая транзакция не должна достаться следующей записи
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            metrics.observe("db_query_seconds", time.perf_counter() - started, db=self.db_name, query=func.__name__)
+
+    def _run_read(self, func, args, kwargs):
+        # Потоков-читателей не больше, чем readers, поэтому и соединений создаётся не больше
+        try:
+            conn = self._reader_conns.get_nowait()
+        except queue.Empty:
+            conn = self._connect(read_only=True)
+        started = time.perf_counter()
+        try:
+            return func(conn, *args, **kwargs)
+        finally:
+            metrics.observe("db_query_seconds", time.perf_counter() - started, db=self.db_name, query=func.__name__)
+            self._reader_conns.put(conn)
+
+    async def write(self, func, *args, **kwargs):
+        """Выполняет func(conn, *args, **kwargs) на соединении-писателе"""
+        loop = asyncio.get_running_loop()
+        # db_call_seconds включает ожидание свободного потока, db_query_seconds - только сам запрос
+        with metrics.timer("db_call_seconds", db=self.db_name, kind="write"):
+            return await loop.run_in_executor(
+                self._write_executor, functools.partial(self._run_write, func, args, kwargs)
+            )
+
+    async def read(self, func, *args, **kwargs):
+        """Выполняет func(conn, *args, **kwargs) на одном из соединений-читателей"""
+        loop = asyncio.get_running_loop()
+        with metrics.timer("db_call_seconds", db=self.db_name, kind="read"):
+            return await loop.run_in_executor(
+                self._read_executor, functools.partial(self._run_read, func, args, kwargs)
+            )
+
+    def close(self):
+        """Дожидается выполнения поставленных запросов и закрывает все соединения"""
+        self._write_executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+        for conn in self._all_conns:
+            conn.close()
+        self._all_conns.clear()
+        self._writer_conn = None
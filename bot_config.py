@@ -0,0 +1,21 @@
+from functools import lru_cache
+
+USER_CONFIG_FILE = "user_config.txt"
+
+
+@lru_cache(maxsize=None)
+def read_user_config(path: str = USER_CONFIG_FILE) -> tuple:
+    """Токен бота и id администратора из user_config.txt (строки TOKEN=... и ADMINID=...).
+    Файл читается при первом обращении, а не при импорте бота"""
+    with open(path) as f:
+        token = f.readline().replace("TOKEN=", "").replace("\n", "")
+        admin_id = f.readline().replace("ADMINID=", "").strip()
+    return token, admin_id
+
+
+def get_bot_token() -> str:
+    return read_user_config()[0]
+
+
+def get_admin_id() -> str:
+    return read_user_config()[1]
@@ -0,0 +1,64 @@
+import inspect
+from typing import NamedTuple
+
+
+class ParsedCallback(NamedTuple):
+    prefix: str   # "mood" для "mood_calm"
+    payload: str  # "calm" для "mood_calm"
+
+
+def parse_callback_data(data: str) -> ParsedCallback:
+    prefix, _, payload = data.partition("_")
+    return ParsedCallback(prefix, payload)
+
+
+class CallbackRouter:
+    """Маршрутизация колбэков через словари вместо цепочки фильтров-лямбд.
+
+    callback_data разбирается один раз на префикс и содержимое, обработчик находится поиском
+    в словаре: сначала по точному значению ("plot"), затем по префиксу до первого "_" ("mood_calm").
+    Обработчик получает только те аргументы, которые объявил: callback_query, parsed, state и т.д.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = {}
+
+    @staticmethod
+    def _wrap(handler):
+        return handler, frozenset(inspect.signature(handler).parameters)
+
+    def exact(self, data: str):
+        def decorator(handler):
+            self._exact[data] = self._wrap(handler)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str):
+        def decorator(handler):
+            for prefix in prefixes:
+                self._prefixes[prefix] = self._wrap(handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str):
+        """Возвращает (обработчик, набор его аргументов, ParsedCallback); обработчик None, если не найден"""
+        parsed = parse_callback_data(data)
+        route = self._exact.get(data) or self._prefixes.get(parsed.prefix)
+        if route is None:
+            return None, frozenset(), parsed
+        return route[0], route[1], parsed
+
+    def handler_name(self, data: str):
+        handler, _, _ = self.resolve(data or "")
+        return handler.__name__ if handler is not None else None
+
+    async def dispatch(self, callback_query, **data):
+        """Вызывает обработчик колбэка. Возвращает False, если обработчика нет"""
+        handler, params, parsed = self.resolve(callback_query.data or "")
+        if handler is None:
+            return False
+        data["callback_query"] = callback_query
+        data["parsed"] = parsed
+        await handler(**{name: data[name] for name in params if name in data})
+        return True
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+
+class ChartCache:
+    """LRU-кэш отрисованных графиков в памяти.
+
+    Ключ - (user_id, год, месяц, версия данных), значение - байты PNG. Суммарный размер
+    изображений ограничен max_bytes: при переполнении вытесняются давно не запрошенные графики.
+    Новая запись настроения увеличивает версию данных месяца, поэтому устаревший график
+    просто перестаёт запрашиваться и со временем вытесняется.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        image = self._items.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image: bytes):
+        if len(image) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size_bytes -= len(old)
+        self._items[key] = image
+        self.size_bytes += len(image)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._items),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,23 @@
+import importlib
+
+# Движки отрисовки графиков: имя -> модуль. Каждый модуль предоставляет одинаковые функции
+#   render_mood_pie(mood_counts, title, image_format) - круговая диаграмма за месяц,
+#   render_weekly_trend(week_starts, counts, days, rolling, title, image_format) - тренд по неделям,
+#   render_year_heatmap(grid, year, title, image_format) - календарь года,
+#   warm_up() - прогрев процесса-отрисовщика,
+# которые возвращают готовое изображение (png или webp) в байтах.
+# pillow - быстрый движок без matplotlib, matplotlib - медленнее, но с полной вёрсткой и сглаживанием
+CHART_RENDERERS = {
+    "pillow": "pillow_charts",
+    "matplotlib": "plot_visualisaion",
+}
+DEFAULT_RENDERER = "pillow"
+IMAGE_FORMATS = ("png", "webp")
+
+
+def get_renderer(name: str = None):
+    """Модуль движка отрисовки по имени; модуль импортируется только при первом обращении"""
+    name = name or DEFAULT_RENDERER
+    if name not in CHART_RENDERERS:
+        raise ValueError(f"Неизвестный движок отрисовки графиков: {name}")
+    return importlib.import_module(CHART_RENDERERS[name])
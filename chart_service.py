@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from chart_renderers import DEFAULT_RENDERER, get_renderer
+from metrics import metrics
+from mood_time import months_list
+
+logger = logging.getLogger(__name__)
+
+
+class ChartQueueFull(Exception):
+    """В очереди на отрисовку уже слишком много графиков"""
+
+
+class ChartTimeout(Exception):
+    """График не успел отрисоваться за отведённое время"""
+
+
+class ChartRenderError(Exception):
+    """Процесс-отрисовщик упал (например, не хватило памяти); пул будет запущен заново"""
+
+
+# --- Код, который выполняется в процессах-отрисовщиках ---
+# Движок отрисовки и формат изображений процесса-отрисовщика, задаются в _init_worker
+_renderer_name = DEFAULT_RENDERER
+_image_format = "png"
+
+
+def _init_worker(renderer_name: str = DEFAULT_RENDERER, image_format: str = "png"):
+    """Готовит процесс к отрисовке: загружает движок (см. chart_renderers) и прогревает его пробным графиком,
+    чтобы первый настоящий график не ждал импортов и загрузки шрифтов"""
+    global _renderer_name, _image_format
+    if renderer_name == "matplotlib":
+        # Бэкенд Agg без GUI выбирается до импорта pyplot
+        import matplotlib
+        matplotlib.use("Agg")
+    _renderer_name = renderer_name
+    _image_format = image_format
+    get_renderer(renderer_name).warm_up()
+
+
+def _ping():
+    return True
+
+
+def render_month_chart(mood_counts: dict, month: int, year: int) -> bytes:
+    """Рисует круговую диаграмму за месяц по готовым счётчикам и возвращает изображение"""
+    return get_renderer(_renderer_name).render_mood_pie(mood_counts, months_list[month - 1], _image_format)
+
+
+def render_weekly_chart(data: dict) -> bytes:
+    """Тренд по неделям по данным из mood_analytics.weekly_trend_data"""
+    return get_renderer(_renderer_name).render_weekly_trend(
+        data["week_starts"], data["counts"], data["days"], data["rolling"], "Настроение по неделям", _image_format
+    )
+
+
+def render_heatmap_chart(grid, year: int) -> bytes:
+    """Календарь года по данным из mood_analytics.year_heatmap_data"""
+    return get_renderer(_renderer_name).render_year_heatmap(grid, year, f"Календарь настроения за {year} год", _image_format)
+
+
+# --- Сервис, которым пользуется бот ---
+class ChartRenderService:
+    """Отрисовка графиков в пуле процессов, чтобы matplotlib не занимал цикл событий бота.
+
+    Число графиков в пуле ограничено max_queue: лишние запросы сразу получают ChartQueueFull,
+    а не копятся в памяти. Каждый график ждём не дольше timeout секунд, но место в очереди освобождается,
+    только когда процесс действительно закончит работу. Если процесс упал, пул запускается заново.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: float = 30.0,
+                 renderer: str = DEFAULT_RENDERER, image_format: str = "png"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # renderer - имя движка из chart_renderers.CHART_RENDERERS, image_format - "png" или "webp"
+        self.renderer = renderer
+        self.image_format = image_format
+        self._pool = None
+        self._pending = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    async def start(self):
+        """Запускает процессы заранее, чтобы первый график не ждал импорта matplotlib"""
+        if self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.renderer, self.image_format)
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, _ping) for _ in range(self.workers)])
+        logger.info(f"Пул отрисовки графиков запущен: {self.workers} процесс(а), движок {self.renderer}")
+
+    async def render(self, func, *args):
+        """Выполняет func(*args) в процессе-отрисовщике и возвращает результат"""
+        if self._pool is None:
+            await self.start()
+        if self._pending >= self.max_queue:
+            metrics.inc("chart_rejected", reason="queue_full")
+            raise ChartQueueFull()
+
+        pool = self._pool
+        started = time.perf_counter()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise ChartRenderError()
+        self._pending += 1
+        # Таймаут не останавливает работу в процессе: график, который ждать перестали, всё ещё занимает
+        # отрисовщик, поэтому место в очереди освобождается по завершении задания, а не по таймауту
+        future.add_done_callback(lambda done: self._finish(done, func.__name__, started))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("chart_rejected", reason="timeout")
+            logger.error(f"Отрисовка {func.__name__}{args} не уложилась в {self.timeout} с")
+            raise ChartTimeout()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise ChartRenderError()
+
+    def _finish(self, future, chart: str, started: float):
+        self._pending -= 1
+        metrics.observe("chart_render_seconds", time.perf_counter() - started, chart=chart)
+        if not future.cancelled():
+            # Ошибку задания, результат которого уже не ждут, не нужно выводить как "never retrieved"
+            future.exception()
+
+    def _discard_pool(self, pool):
+        # Пул с упавшим процессом отклоняет все следующие задания; новый запустится при следующем графике
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            metrics.inc("chart_pool_restarts")
+            logger.error("Процесс отрисовки графиков упал, пул будет запущен заново")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,370 @@
+"""
+Нагрузочный тест бота без Telegram.
+
+Настоящий Dispatcher из mood_tracker_bot получает синтетические апдейты, а все запросы к Bot API
+уходят в FakeTelegramSession: она записывает вызовы, добавляет задержку и с заданной вероятностью
+отвечает ошибками. Бот работает во временной папке со своими базами, рабочие базы не затрагиваются.
+
+Пример:
+    python load_test.py --users 200 --taps 5 --pages 3 --charts 1 --latency-ms 40 --output report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, GetMe
+from aiogram.types import Message, Update, User
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOKEN = "123456:LOAD-TEST-TOKEN"
+
+
+class FakeTelegramSession(BaseSession):
+    """Подмена HTTP-сессии aiogram: вместо запросов к Bot API отвечает сама"""
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            # Разброс задержки как у настоящей сети: от половины до полутора заданных значений
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+        if self.error_rate and not isinstance(method, (GetMe, AnswerCallbackQuery)) and self.random.random() < self.error_rate:
+            self.errors[name] += 1
+            if self.random.random() < 0.5:
+                raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=1)
+            raise TelegramServerError(method=method, message="Internal Server Error")
+
+        if isinstance(method, GetMe):
+            return User(id=123456, is_bot=True, first_name="LoadTest", username="load_test_bot")
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        if isinstance(method, EditMessageText) or "Message" in str(method.__returning__):
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message.model_validate({
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": getattr(method, "text", None) or "",
+            })
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, name: str, seconds: float):
+        self.samples[name].append(seconds)
+
+    @staticmethod
+    def _percentile(values: list, percent: float) -> float:
+        index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+        return values[index]
+
+    def summary(self) -> dict:
+        report = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            report[name] = {
+                "count": len(values),
+                "p50_ms": self._percentile(values, 50) * 1000,
+                "p95_ms": self._percentile(values, 95) * 1000,
+                "p99_ms": self._percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return report
+
+
+def time_database(database, recorder: LatencyRecorder, label: str):
+    """Оборачивает read/write экземпляра AsyncDatabase, чтобы считать время запросов"""
+    for kind in ("read", "write"):
+        original = getattr(database, kind)
+
+        async def timed(func, *args, _original=original, _kind=kind, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await _original(func, *args, **kwargs)
+            finally:
+                recorder.add(f"{label}.{_kind}.{func.__name__}", time.perf_counter() - started)
+
+        setattr(database, kind, timed)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # На Linux ru_maxrss в килобайтах, на macOS - в байтах
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {"bot_process": own, "largest_child_process": children}
+
+
+# --- Синтетические апдейты ---
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def command(self, user_id: int, text: str) -> Update:
+        update_id, message_id = self._next_ids()
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+            },
+        })
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id, message_id = self._next_ids()
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "...",
+                },
+            },
+        })
+
+
+def seed_history(bot_module, user_ids: list, per_user: int):
+    """Заполняет базу историей настроений за последний год, чтобы были страницы и графики"""
+    from add_mood_to_db import add_moods_batch, connect_db
+    from mood_catalog import MOODS
+    from mood_time import MSK_UTC_OFFSET
+
+    conn = connect_db(bot_module.db.db_name)
+    now = datetime.now()
+    rng = random.Random(1)
+    rows = []
+    for user_id in user_ids:
+        for _ in range(per_user):
+            timestamp = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+            mood = rng.choice(MOODS)
+            rows.append((user_id, mood.id, int(timestamp.timestamp()), MSK_UTC_OFFSET))
+            if len(rows) >= 10_000:
+                add_moods_batch(conn, rows)
+                rows = []
+    if rows:
+        add_moods_batch(conn, rows)
+    conn.close()
+
+
+async def run_scenario(name, updates, bot_module, bot, recorder, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = Counter()
+
+    async def feed(label, update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await bot_module.dp.feed_update(bot, update)
+            except Exception as e:
+                # При polling такие ошибки только логируются, здесь - считаются
+                errors[type(e).__name__] += 1
+            recorder.add(label, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[feed(label, update) for label, update in updates])
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_second": len(updates) / elapsed if elapsed else None,
+        "handler_errors": dict(errors),
+    }
+
+
+async def run_load_test(args) -> dict:
+    import mood_tracker_bot as bot_module
+    from add_mood_to_db import ensure_monthly_counts
+    from migrations import apply_migrations
+    from mood_catalog import MOODS
+
+    session = FakeTelegramSession(latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed)
+    bot = Bot(token=FAKE_TOKEN, session=session)
+    bot_module.bot = bot
+
+    handler_latency = LatencyRecorder()
+    db_latency = LatencyRecorder()
+    time_database(bot_module.db, db_latency, "mood_base")
+
+    await bot_module.db.write(apply_migrations)
+
+    user_ids = [1_000_000 + i for i in range(args.users)]
+    if args.history:
+        seed_history(bot_module, user_ids, args.history)
+    await bot_module.db.write(ensure_monthly_counts)
+
+    await bot_module.mood_ingestor.start()
+    if args.charts:
+        await bot_module.chart_service.start()
+    if args.reminder_rate:
+        bot_module.reminder_dispatcher.bucket.rate = args.reminder_rate
+        bot_module.reminder_dispatcher.bucket.capacity = args.reminder_rate
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    scenarios = {}
+    try:
+        # Нажатия на кнопки настроения
+        updates = [("mood_tap", factory.callback(user_id, f"mood_{rng.choice(MOODS).code}"))
+                   for _ in range(args.taps) for user_id in user_ids]
+        scenarios["mood_taps"] = await run_scenario("mood_taps", updates, bot_module, bot, handler_latency, args.concurrency)
+
+        # /mydata и листание истории
+        updates = [("mydata", factory.command(user_id, "/mydata")) for user_id in user_ids]
+        for user_id in user_ids:
+            updates.append(("history_page", factory.callback(user_id, "hist_0")))
+        scenarios["mydata"] = await run_scenario("mydata", updates, bot_module, bot, handler_latency, args.concurrency)
+
+        if args.pages:
+            # Каждый пользователь листает историю вперёд по настоящим курсорам из базы
+            from add_mood_to_db import get_mood_history_page
+            updates = []
+            for user_id in user_ids:
+                cursor_id = cursor_ts = None
+                for page in range(1, args.pages + 1):
+                    rows = await bot_module.db.read(get_mood_history_page, user_id, cursor_id, "older", 30, cursor_ts)
+                    if not rows:
+                        break
+                    # Кнопка «Вперёд» передаёт id и время последней записи страницы, как в get_pagination_keyboard
+                    cursor_id, cursor_ts = rows[-1][0], rows[-1][2]
+                    updates.append(("history_page", factory.callback(user_id, f"hist_{page}_o_{cursor_id}_{cursor_ts}")))
+            scenarios["history_pages"] = await run_scenario("history_pages", updates, bot_module, bot, handler_latency, args.concurrency)
+
+        if args.charts:
+            now = datetime.now()
+            updates = [("month_chart", factory.callback(user_id, f"month_{now.year}_{now.month}"))
+                       for _ in range(args.charts) for user_id in user_ids]
+            scenarios["month_charts"] = await run_scenario("month_charts", updates, bot_module, bot, handler_latency, args.concurrency)
+
+        if args.reminders:
+            reminder_users = [user_ids[i % len(user_ids)] for i in range(args.reminders)]
+            started = time.perf_counter()
+            await bot_module.reminder_dispatcher.dispatch(reminder_users, time.time())
+            elapsed = time.perf_counter() - started
+            scenarios["reminder_burst"] = {
+                "reminders": len(reminder_users),
+                "seconds": elapsed,
+                "reminders_per_second": len(reminder_users) / elapsed if elapsed else None,
+                **bot_module.reminder_dispatcher.stats(),
+            }
+    finally:
+        await bot_module.mood_ingestor.stop()
+        bot_module.chart_service.shutdown()
+
+    total_updates = sum(s.get("updates", 0) for s in scenarios.values())
+    total_seconds = sum(s["seconds"] for s in scenarios.values() if "updates" in s)
+    db_summary = db_latency.summary()
+    return {
+        "params": vars(args),
+        "scenarios": scenarios,
+        "handler_latency": handler_latency.summary(),
+        "throughput_updates_per_second": total_updates / total_seconds if total_seconds else None,
+        "db": {
+            "total_seconds": sum(sum(v) for v in db_latency.samples.values()),
+            "queries": db_summary,
+        },
+        "ingest": bot_module.mood_ingestor.stats(),
+        "telegram_calls": dict(session.calls),
+        "telegram_injected_errors": dict(session.errors),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с подменой Telegram Bot API")
+    parser.add_argument("--users", type=int, default=100, help="число одновременных пользователей")
+    parser.add_argument("--taps", type=int, default=5, help="нажатий на настроение на пользователя")
+    parser.add_argument("--history", type=int, default=300, help="записей истории на пользователя перед тестом")
+    parser.add_argument("--pages", type=int, default=3, help="страниц истории, которые пролистывает пользователь")
+    parser.add_argument("--charts", type=int, default=1, help="запросов графика за месяц на пользователя")
+    parser.add_argument("--reminders", type=int, default=100, help="размер всплеска напоминаний")
+    parser.add_argument("--reminder-rate", type=float, default=None, help="сообщений в секунду для рассылки (по умолчанию как в боте)")
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько апдейтов обрабатывается одновременно")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="средняя задержка ответа Bot API")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, на которые Bot API отвечает ошибкой")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="папка для баз теста (по умолчанию временная)")
+    parser.add_argument("--output", default=None, help="куда сохранить отчёт JSON (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mood_bot_load_")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Бот читает конфиг и открывает базы относительно текущей папки
+    with open(os.path.join(workdir, "user_config.txt"), "w") as f:
+        f.write(f"TOKEN={FAKE_TOKEN}\nADMINID=0\n")
+    os.chdir(workdir)
+    sys.path.insert(0, PROJECT_DIR)
+
+    report = asyncio.run(run_load_test(args))
+    report["workdir"] = workdir
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: память постоянна при любом числе наблюдений"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        # Запросы к базе наблюдаются из потоков пула, поэтому нужна блокировка
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попадает"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+
+class MetricsRegistry:
+    """Счётчики, гистограммы и вычисляемые показатели бота.
+    Метрика задаётся именем и метками: metrics.observe("handler_seconds", 0.03, handler="show_my_data")"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name: str, func, **labels):
+        """Регистрирует показатель, который вычисляется в момент чтения метрик"""
+        self.gauges[self._key(name, labels)] = func
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=()) -> str:
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"mood_bot_{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"mood_bot_{name}_sum{self._format_labels(labels)} {histogram.sum}")
+            lines.append(f"mood_bot_{name}_count{self._format_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"mood_bot_{name}_total{self._format_labels(labels)} {value}")
+        for (name, labels), func in sorted(self.gauges.items(), key=lambda item: item[0]):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"mood_bot_{name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary_text(self) -> str:
+        """Короткая сводка для команды /stats"""
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in self.histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            lines.append(f"{name}:")
+            rows = sorted(by_name[name], key=lambda item: item[1].sum, reverse=True)
+            for labels, h in rows[:10]:
+                label = ",".join(str(v) for _, v in labels) or "-"
+                lines.append(
+                    f"  {label}: n={h.count} p50≤{h.quantile(0.5) * 1000:.0f}мс "
+                    f"p95≤{h.quantile(0.95) * 1000:.0f}мс p99≤{h.quantile(0.99) * 1000:.0f}мс max={h.max * 1000:.0f}мс"
+                )
+        if self.counters:
+            lines.append("Счётчики:")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"  {name}{self._format_labels(labels)} = {value:g}")
+        if self.gauges:
+            lines.append("Текущие значения:")
+            for (name, labels), func in sorted(self.gauges.items(), key=lambda item: item[0]):
+                try:
+                    value = func()
+                except Exception:
+                    continue
+                lines.append(f"  {name}{self._format_labels(labels)} = {value:g}")
+        return "\n".join(lines) or "Пока нет данных"
+
+
+# Общий реестр метрик процесса
+metrics = MetricsRegistry()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика апдейтов. name_resolver(event) может вернуть более точное имя,
+    например имя обработчика колбэка, выбранного CallbackRouter"""
+
+    def __init__(self, registry: MetricsRegistry = metrics, name_resolver=None):
+        self.registry = registry
+        self.name_resolver = name_resolver
+
+    async def __call__(self, handler, event, data):
+        name = None
+        if self.name_resolver is not None:
+            name = self.name_resolver(event)
+        if name is None:
+            handler_object = data.get("handler")
+            name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.registry.inc("handler_errors", handler=name)
+            raise
+        finally:
+            self.registry.observe("handler_seconds", time.perf_counter() - started, handler=name)
@@ -0,0 +1,196 @@
+import logging
+import os
+import sys
+import time
+from typing import NamedTuple
+
+from add_mood_to_db import (
+    connect_db,
+    create_chart_files_table,
+    create_indexes,
+    create_notification_seq_index,
+    create_table,
+    create_users_table,
+    ensure_monthly_counts,
+    get_table_columns,
+    migrate_timestamps,
+)
+from mood_archive import create_archive_table
+from mood_catalog import MOODS
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: object        # apply(conn, options) - изменяет схему
+    transactional: bool  # False - миграция сама управляет транзакциями (ATTACH, пакетный перенос)
+
+
+# --- Миграции ---
+def _m001_users(conn, options):
+    """Таблица users в общей базе; настройки переносятся из отдельной users.db, если она есть"""
+    create_users_table(conn)
+    legacy_path = options.get("legacy_users_db")
+    if not legacy_path or not os.path.exists(legacy_path):
+        return
+    # ATTACH нельзя выполнить внутри транзакции
+    conn.execute('ATTACH DATABASE ? AS legacy_users', (legacy_path,))
+    try:
+        if conn.execute("SELECT 1 FROM legacy_users.sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+            with conn:
+                # '+2' из старой колонки TEXT превращается в число по типу колонки time_zone
+                conn.execute('''
+                    INSERT OR IGNORE INTO users (user_id, notification_time, time_zone)
+                    SELECT user_id, notification_time, NULLIF(time_zone, '') FROM legacy_users.users
+                ''')
+            logger.info(f"Настройки пользователей перенесены из {legacy_path}")
+    finally:
+        conn.execute('DETACH DATABASE legacy_users')
+
+def _m002_epoch_timestamps(conn, options):
+    """Время записей в секундах UTC (см. migrate_timestamps) и месячные счётчики"""
+    create_table(conn)
+    migrate_timestamps(
+        conn,
+        chunk_size=options.get("chunk_size", 5000),
+        source_utc_offset=options.get("source_utc_offset"),
+        progress=options.get("progress"),
+    )
+    create_indexes(conn)
+    ensure_monthly_counts(conn)
+
+def _m003_mood_catalog(conn, options):
+    """Справочник mood_catalog; в moods остаются только числа (id, user_id, ts, mood_id)"""
+    conn.execute('''
+        CREATE TABLE mood_catalog (
+            id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE,
+            label TEXT NOT NULL
+        )
+    ''')
+    conn.executemany('INSERT INTO mood_catalog (id, code, label) VALUES (?, ?, ?)',
+                     [(mood.id, mood.code, mood.label) for mood in MOODS])
+    if 'mood' not in get_table_columns(conn, 'moods'):
+        return
+    # Настроения из старых записей, которых нет в справочнике, сохраняются с подписью из самой записи
+    conn.execute('''
+        INSERT OR IGNORE INTO mood_catalog (id, code, label)
+        SELECT mood_id, 'legacy_' || mood_id, MIN(mood) FROM moods GROUP BY mood_id
+    ''')
+    conn.execute('''
+        CREATE TABLE moods_v3 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            mood_id INTEGER NOT NULL REFERENCES mood_catalog (id)
+        )
+    ''')
+    conn.execute('INSERT INTO moods_v3 (id, user_id, ts, mood_id) SELECT id, user_id, ts, mood_id FROM moods')
+    conn.execute('DROP TABLE moods')
+    conn.execute('ALTER TABLE moods_v3 RENAME TO moods')
+    conn.execute('CREATE INDEX idx_moods_user_ts ON moods (user_id, ts)')
+
+def _m004_chart_files(conn, options):
+    """file_id графиков, уже отправленных в Telegram (см. get_month_chart_file)"""
+    create_chart_files_table(conn)
+
+def _m005_mood_archive(conn, options):
+    """Оглавление архива старых месяцев (см. mood_archive.py)"""
+    create_archive_table(conn)
+
+def _m006_notification_seq(conn, options):
+    """Номер изменения времени напоминания: шарды перечитывают только изменившиеся строки users"""
+    if 'notification_seq' not in get_table_columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN notification_seq INTEGER NOT NULL DEFAULT 0')
+    create_notification_seq_index(conn)
+
+
+MIGRATIONS = (
+    Migration(1, "users", _m001_users, transactional=False),
+    Migration(2, "epoch_timestamps", _m002_epoch_timestamps, transactional=False),
+    Migration(3, "mood_catalog", _m003_mood_catalog, transactional=True),
+    Migration(4, "chart_files", _m004_chart_files, transactional=False),
+    Migration(5, "mood_archive", _m005_mood_archive, transactional=False),
+    Migration(6, "notification_seq", _m006_notification_seq, transactional=True),
+)
+
+
+# --- Применение ---
+def _ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+def get_current_version(conn) -> int:
+    _ensure_version_table(conn)
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def sync_mood_catalog(conn):
+    """Приводит mood_catalog в соответствие с MOODS: новые настроения добавляются, подписи обновляются"""
+    with conn:
+        conn.executemany('''
+            INSERT INTO mood_catalog (id, code, label) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET code = excluded.code, label = excluded.label
+        ''', [(mood.id, mood.code, mood.label) for mood in MOODS])
+
+def apply_migrations(conn, **options) -> list:
+    """Применяет по порядку все миграции новее текущей версии. Возвращает номера применённых.
+
+    options: legacy_users_db - путь к старой users.db для переноса настроек,
+    chunk_size, source_utc_offset, progress - параметры переноса времени записей (migrate_timestamps).
+    Транзакционная миграция и запись о ней в schema_version фиксируются одним коммитом;
+    остальные написаны так, чтобы прерванный запуск можно было просто повторить.
+    """
+    current = get_current_version(conn)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        logger.info(f"Применяется миграция {migration.version}: {migration.name}")
+        record = ('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                  (migration.version, migration.name, int(time.time())))
+        if migration.transactional:
+            # DDL в sqlite3 по умолчанию выполняется вне транзакции, поэтому она открывается явно
+            conn.execute('BEGIN')
+            try:
+                migration.apply(conn, options)
+                conn.execute(*record)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        else:
+            migration.apply(conn, options)
+            with conn:
+                conn.execute(*record)
+        applied.append(migration.version)
+    sync_mood_catalog(conn)
+    return applied
+
+
+if __name__ == '__main__':
+    # python migrations.py [mood_base.db] [users.db] - обновить схему базы до последней версии
+    #     (MIGRATE_CHUNK_SIZE - записей в пачке при переносе времени,
+    #      MIGRATE_SOURCE_UTC_OFFSET - смещение сервера от UTC в часах для старых записей)
+    logging.basicConfig(level=logging.INFO)
+    conn = connect_db(sys.argv[1] if len(sys.argv) > 1 else 'mood_base.db')
+    source_offset = os.getenv("MIGRATE_SOURCE_UTC_OFFSET")
+    applied = apply_migrations(
+        conn,
+        legacy_users_db=sys.argv[2] if len(sys.argv) > 2 else 'users.db',
+        chunk_size=int(os.getenv("MIGRATE_CHUNK_SIZE", "5000")),
+        source_utc_offset=float(source_offset) * 60 * 60 if source_offset else None,
+        progress=lambda done: print(f"Перенесено записей: {done}", flush=True),
+    )
+    print(f"Версия схемы: {get_current_version(conn)}, применены миграции: {applied or 'нет'}")
+    if applied:
+        # Место старых таблиц освобождается только после VACUUM
+        conn.execute('VACUUM')
+    conn.close()
@@ -0,0 +1,208 @@
+from itertools import chain
+from typing import NamedTuple
+
+import numpy as np
+
+from mood_archive import iter_archived, read_snapshot
+from mood_catalog import MOODS
+
+SECONDS_IN_DAY = 24 * 60 * 60
+# 1 января 1970 - четверг: сдвиг на 3 дня делает началом недели понедельник
+EPOCH_WEEKDAY_SHIFT = 3
+# Столбцы счётчиков по окраске настроения: неприятное, нейтральное, приятное
+VALENCE_GROUPS = (-1, 0, 1)
+
+
+class MoodHistory(NamedTuple):
+    ts: np.ndarray        # int64, секунды UTC, по возрастанию
+    mood_ids: np.ndarray  # int32
+    utc_offset: int       # смещение пользователя от UTC в секундах
+
+    @property
+    def days(self) -> np.ndarray:
+        """Номер дня от 1970-01-01 по местному времени пользователя для каждой записи"""
+        return (self.ts + self.utc_offset) // SECONDS_IN_DAY
+
+    @property
+    def valence(self) -> np.ndarray:
+        return _valence_lookup(self.mood_ids)[self.mood_ids]
+
+
+def _valence_lookup(mood_ids: np.ndarray) -> np.ndarray:
+    # Настроения, которых нет в MOODS (перенесённые из старых баз), считаются нейтральными
+    size = max(len(MOODS), int(mood_ids.max()) + 1 if len(mood_ids) else 0)
+    lookup = np.zeros(size, dtype=np.int8)
+    for mood in MOODS:
+        lookup[mood.id] = mood.valence
+    return lookup
+
+
+def days_to_dates(days) -> np.ndarray:
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]')
+
+
+def fetch_user_history(conn, user_id: int, utc_offset: int, start_ts=None, end_ts=None) -> MoodHistory:
+    """Читает историю пользователя (из moods и из архива) сразу в два столбца NumPy, без списка кортежей в памяти"""
+    query = 'SELECT ts, mood_id FROM moods WHERE user_id = ?'
+    params = [user_id]
+    if start_ts is not None:
+        query += ' AND ts >= ?'
+        params.append(start_ts)
+    if end_ts is not None:
+        query += ' AND ts < ?'
+        params.append(end_ts)
+    query += ' ORDER BY ts'
+    with read_snapshot(conn):
+        archived = np.fromiter(
+            chain.from_iterable((ts, mood_id) for _, ts, mood_id in iter_archived(conn, user_id, start_ts, end_ts)),
+            dtype=np.int64
+        )
+        flat = np.fromiter(chain.from_iterable(conn.execute(query, params)), dtype=np.int64)
+    pairs = flat.reshape(-1, 2)
+    if len(archived):
+        # Записи, импортированные задним числом, могут оказаться в moods раньше архивных
+        pairs = np.concatenate((archived.reshape(-1, 2), pairs))
+        pairs = pairs[np.argsort(pairs[:, 0], kind="stable")]
+    return MoodHistory(pairs[:, 0].copy(), pairs[:, 1].astype(np.int32), utc_offset)
+
+
+# --- Распределения ---
+def daily_counts(history: MoodHistory) -> tuple:
+    """Счётчики по дням без пропусков от первого дня с записями до последнего.
+    Возвращает (номера дней, матрица [дни x VALENCE_GROUPS])"""
+    days = history.days
+    if not len(days):
+        return np.empty(0, dtype=np.int64), np.empty((0, len(VALENCE_GROUPS)), dtype=np.int64)
+    first = days[0]
+    n_days = int(days[-1] - first) + 1
+    group = history.valence + 1
+    counts = np.bincount((days - first) * len(VALENCE_GROUPS) + group, minlength=n_days * len(VALENCE_GROUPS))
+    return np.arange(first, first + n_days), counts.reshape(n_days, len(VALENCE_GROUPS))
+
+
+def weekly_counts(history: MoodHistory) -> tuple:
+    """Счётчики по неделям (с понедельника) без пропусков. Возвращает (первые дни недель, матрица [недели x группы])"""
+    days, counts = daily_counts(history)
+    if not len(days):
+        return days, counts
+    weeks = (days + EPOCH_WEEKDAY_SHIFT) // 7
+    first = weeks[0]
+    n_weeks = int(weeks[-1] - first) + 1
+    weekly = np.zeros((n_weeks, counts.shape[1]), dtype=np.int64)
+    np.add.at(weekly, weeks - first, counts)
+    week_starts = (np.arange(first, first + n_weeks) * 7) - EPOCH_WEEKDAY_SHIFT
+    return week_starts, weekly
+
+
+def _window_sum(values: np.ndarray, window: int) -> np.ndarray:
+    cumulative = np.cumsum(values)
+    sums = cumulative.copy()
+    sums[window:] -= cumulative[:-window]
+    return sums
+
+
+def rolling_valence(history: MoodHistory, window: int = 7) -> tuple:
+    """Средняя окраска настроения за скользящее окно в window дней (от -1 до 1, NaN - нет записей).
+    Суммы окон считаются через накопленную сумму за один проход"""
+    days, counts = daily_counts(history)
+    if not len(days):
+        return days, np.empty(0)
+    score_sum = _window_sum(counts @ np.array(VALENCE_GROUPS), window)
+    total_sum = _window_sum(counts.sum(axis=1), window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return days, np.where(total_sum > 0, score_sum / total_sum, np.nan)
+
+
+def streaks(history: MoodHistory, today=None) -> tuple:
+    """(самая длинная серия дней подряд с записями, текущая серия). Текущая не прерывается,
+    если сегодня запись ещё не сделана, но вчера была"""
+    days = np.unique(history.days)
+    if not len(days):
+        return 0, 0
+    breaks = np.flatnonzero(np.diff(days) != 1) + 1
+    bounds = np.concatenate(([0], breaks, [len(days)]))
+    lengths = np.diff(bounds)
+    if today is None:
+        today = (int(np.datetime64('now', 's').astype(np.int64)) + history.utc_offset) // SECONDS_IN_DAY
+    current = int(lengths[-1]) if days[-1] >= today - 1 else 0
+    return int(lengths.max()), current
+
+
+def year_heatmap(history: MoodHistory, year: int) -> np.ndarray:
+    """Календарь года 7 x 54 (дни недели x недели) со средней окраской настроения за день, NaN - нет записей"""
+    first_day = int(np.datetime64(f"{year}-01-01", 'D').astype(np.int64))
+    last_day = int(np.datetime64(f"{year + 1}-01-01", 'D').astype(np.int64))
+    grid_start = first_day - (first_day + EPOCH_WEEKDAY_SHIFT) % 7
+    days = history.days
+    in_year = (days >= first_day) & (days < last_day)
+    days = days[in_year]
+    valence = history.valence[in_year].astype(np.int64)
+
+    cells = days - grid_start
+    total = np.bincount(cells, minlength=7 * 54)[:7 * 54]
+    score = np.bincount(cells, weights=valence, minlength=7 * 54)[:7 * 54]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(total > 0, score / total, np.nan)
+    # Ячейки идут по неделям подряд, поэтому после reshape строки - недели, столбцы - дни недели
+    return mean.reshape(54, 7).T
+
+
+def yearly_summary(history: MoodHistory) -> list:
+    """Итоги по годам: число записей, дней с записями, доли окраски, самое частое настроение и лучшая серия"""
+    if not len(history.ts):
+        return []
+    days = history.days
+    years = days_to_dates(days).astype('datetime64[Y]').astype(np.int64) + 1970
+    valence = history.valence
+    summary = []
+    for year in np.unique(years):
+        mask = years == year
+        year_history = MoodHistory(history.ts[mask], history.mood_ids[mask], history.utc_offset)
+        mood_counts = np.bincount(year_history.mood_ids)
+        longest, _ = streaks(year_history, today=0)
+        summary.append({
+            "year": int(year),
+            "records": int(mask.sum()),
+            "days": int(len(np.unique(days[mask]))),
+            "positive_share": float((valence[mask] > 0).mean()),
+            "negative_share": float((valence[mask] < 0).mean()),
+            "top_mood_id": int(mood_counts.argmax()),
+            "longest_streak": longest,
+        })
+    return summary
+
+
+# --- Данные для графиков (выполняются в потоке чтения базы) ---
+def weekly_trend_data(conn, user_id: int, utc_offset: int, weeks: int = 26):
+    """Недельные счётчики по окраске и скользящая средняя за последние weeks недель. None, если записей нет"""
+    now = int(np.datetime64('now', 's').astype(np.int64))
+    history = fetch_user_history(conn, user_id, utc_offset, start_ts=now - (weeks * 7 + 7) * SECONDS_IN_DAY)
+    if not len(history.ts):
+        return None
+    week_starts, counts = weekly_counts(history)
+    week_starts, counts = week_starts[-weeks:], counts[-weeks:]
+    days, rolling = rolling_valence(history, window=7)
+    shown = days >= week_starts[0]
+    return {
+        "week_starts": days_to_dates(week_starts),
+        "counts": counts,
+        "days": days_to_dates(days[shown]),
+        "rolling": rolling[shown],
+    }
+
+
+def year_heatmap_data(conn, user_id: int, utc_offset: int, year: int):
+    """Календарь года для графика или None, если записей за год нет"""
+    start = int(np.datetime64(f"{year}-01-01", 's').astype(np.int64)) - utc_offset
+    end = int(np.datetime64(f"{year + 1}-01-01", 's').astype(np.int64)) - utc_offset
+    history = fetch_user_history(conn, user_id, utc_offset, start_ts=start, end_ts=end)
+    if not len(history.ts):
+        return None
+    return year_heatmap(history, year)
+
+
+def user_summary(conn, user_id: int, utc_offset: int) -> dict:
+    """Итоги по годам и текущая серия за всю историю пользователя"""
+    history = fetch_user_history(conn, user_id, utc_offset)
+    longest, current = streaks(history)
+    return {"years": yearly_summary(history), "longest_streak": longest, "current_streak": current}
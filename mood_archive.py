@@ -0,0 +1,272 @@
+"""
+Архив старых записей настроения: закрытые месяцы старше заданного горизонта переносятся из таблицы moods
+в сжатые сегменты archive/moods-ГГГГ-ММ.seg, поэтому горячая таблица и её индекс остаются небольшими.
+
+Сегмент - файл одного месяца (по UTC), в который блоки только дописываются: при каждой архивации месяца -
+по блоку на пользователя. Блок - заголовок BLOCK_HEADER (сигнатура, версия, user_id, число записей,
+длина данных) и сжатые zlib столбцы id, ts (разности соседних значений) и mood_id. Таблица mood_archive
+отображает (user_id, год, месяц) в (файл, смещение, длина), так что история пользователя за месяц -
+это один seek и распаковка одного небольшого блока. Записанные блоки не меняются, поэтому распакованные
+блоки кэшируются.
+
+Месяц переносится одной транзакцией: блоки дописываются и сбрасываются на диск, затем добавляются строки
+mood_archive и удаляются перенесённые записи из moods. Если процесс упадёт до commit, в конце сегмента
+останутся блоки, на которые ничто не ссылается, - они просто не читаются. Месячные счётчики
+(mood_monthly_counts) и id записей при переносе не меняются.
+
+Каталог архива - часть базы: резервная копия mood_base.db без него неполна. Пути сегментов в mood_archive
+записаны относительно каталога файла базы (абсолютный каталог архива - как есть), поэтому базу вместе
+с каталогом архива можно переносить, и бот находит сегменты независимо от текущего каталога.
+
+    python mood_archive.py [база] [месяцев] [каталог] - перенести в архив месяцы старше заданного числа месяцев
+    (таблицу mood_archive создаёт миграция 5: python migrations.py [база])
+"""
+
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import accumulate, groupby
+from operator import itemgetter
+
+from mood_time import MSK_UTC_OFFSET, local_year_month, month_range_utc
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"MSEG"
+SEGMENT_VERSION = 1
+# Сигнатура, версия, user_id, число записей, длина сжатых данных
+BLOCK_HEADER = struct.Struct("<4sBqII")
+
+
+class ArchiveError(RuntimeError):
+    """Блок архива не совпадает с тем, что записано о нём в mood_archive"""
+
+
+def create_archive_table(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mood_archive (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            segment TEXT NOT NULL,
+            block_offset INTEGER NOT NULL,
+            block_length INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, year, month, segment, block_offset)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+def archive_root(conn) -> str:
+    """Каталог файла базы, относительно которого записаны пути сегментов (для базы в памяти - текущий)"""
+    for _, name, path in conn.execute('PRAGMA database_list'):
+        if name == 'main':
+            return os.path.dirname(path)
+    return ''
+
+def has_archive_table(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mood_archive'").fetchone() is not None
+
+@contextmanager
+def read_snapshot(conn):
+    """Запросы к moods и mood_archive внутри видят одно состояние базы: перенос месяца в архив
+    не может произойти между ними, и записи не пропадают и не задваиваются"""
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute('BEGIN')
+    try:
+        yield
+    finally:
+        conn.rollback()
+
+
+# --- Формат блока ---
+def _deltas(values: list) -> list:
+    return values[:1] + [current - previous for previous, current in zip(values, values[1:])]
+
+def _pack_column(values, typecode: str) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+def _unpack_column(data: bytes, typecode: str, start: int, count: int) -> array:
+    column = array(typecode)
+    column.frombytes(data[start:start + count * column.itemsize])
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+def encode_block(user_id: int, rows: list) -> bytes:
+    """rows - записи пользователя (id, ts, mood_id), упорядоченные по (ts, id)"""
+    ids = [row[0] for row in rows]
+    ts = [row[1] for row in rows]
+    payload = zlib.compress(
+        _pack_column(_deltas(ids), "q") + _pack_column(_deltas(ts), "q") + _pack_column([row[2] for row in rows], "i")
+    )
+    return BLOCK_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, user_id, len(rows), len(payload)) + payload
+
+@lru_cache(maxsize=256)
+def read_block(segment: str, block_offset: int, block_length: int) -> tuple:
+    """Записи блока ((id, ts, mood_id), ...) по возрастанию (ts, id)"""
+    with open(segment, "rb") as f:
+        f.seek(block_offset)
+        data = f.read(block_length)
+    if len(data) < BLOCK_HEADER.size:
+        raise ArchiveError(f"Блок {segment}:{block_offset} обрезан")
+    magic, version, _, count, payload_length = BLOCK_HEADER.unpack_from(data)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or BLOCK_HEADER.size + payload_length != len(data):
+        raise ArchiveError(f"Блок {segment}:{block_offset} повреждён")
+    payload = zlib.decompress(data[BLOCK_HEADER.size:])
+    ids = accumulate(_unpack_column(payload, "q", 0, count))
+    ts = accumulate(_unpack_column(payload, "q", count * 8, count))
+    return tuple(zip(ids, ts, _unpack_column(payload, "i", count * 16, count)))
+
+
+# --- Чтение ---
+def _month_overlaps(year: int, month: int, start_ts, end_ts) -> bool:
+    month_start, month_end = month_range_utc(year, month, 0)
+    return (start_ts is None or month_end > start_ts) and (end_ts is None or month_start < end_ts)
+
+def iter_archived(conn, user_id: int, start_ts=None, end_ts=None, newest_first: bool = False):
+    """Архивные записи пользователя (id, ts, mood_id) с ts в [start_ts, end_ts), по порядку (ts, id).
+    Сегменты разных месяцев не пересекаются по времени, поэтому сортируются только блоки одного месяца"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT year, month, segment, block_offset, block_length FROM mood_archive
+        WHERE user_id = ? ORDER BY year, month, block_offset
+    ''', (user_id,))
+    months = [
+        (year_month, [block[2:] for block in blocks])
+        for year_month, blocks in groupby(cursor.fetchall(), key=itemgetter(0, 1))
+        if _month_overlaps(*year_month, start_ts, end_ts)
+    ]
+    if newest_first:
+        months.reverse()
+    root = archive_root(conn)
+    for _, blocks in months:
+        rows = [row for segment, block_offset, block_length in blocks
+                for row in read_block(os.path.join(root, segment), block_offset, block_length)]
+        if len(blocks) > 1:
+            rows.sort(key=itemgetter(1, 0))
+        if newest_first:
+            rows.reverse()
+        for row in rows:
+            if (start_ts is None or row[1] >= start_ts) and (end_ts is None or row[1] < end_ts):
+                yield row
+
+def archived_monthly_counts(conn, user_id: int = None, utc_offset: int = None) -> Counter:
+    """Счётчики архивных записей по местным месяцам: {(user_id, год, месяц, mood_id): count}.
+    Без user_id - всех пользователей в их часовых поясах из users (по умолчанию МСК)"""
+    counts = Counter()
+    if user_id is not None:
+        for _, ts, mood_id in iter_archived(conn, user_id):
+            counts[(user_id,) + local_year_month(ts, utc_offset) + (mood_id,)] += 1
+        return counts
+    if not has_archive_table(conn):
+        return counts
+    offsets = {
+        user: MSK_UTC_OFFSET + (time_zone or 0) * 3600
+        for user, time_zone in conn.execute('SELECT user_id, time_zone FROM users')
+    }
+    root = archive_root(conn)
+    blocks = conn.execute('SELECT user_id, segment, block_offset, block_length FROM mood_archive').fetchall()
+    for user, segment, block_offset, block_length in blocks:
+        offset = offsets.get(user, MSK_UTC_OFFSET)
+        for _, ts, mood_id in read_block(os.path.join(root, segment), block_offset, block_length):
+            counts[(user,) + local_year_month(ts, offset) + (mood_id,)] += 1
+    return counts
+
+def iter_all_archived(conn):
+    """Все архивные записи (user_id, id, ts, mood_id) без определённого порядка"""
+    if not has_archive_table(conn):
+        return
+    root = archive_root(conn)
+    blocks = conn.execute('SELECT user_id, segment, block_offset, block_length FROM mood_archive').fetchall()
+    for user, segment, block_offset, block_length in blocks:
+        for row in read_block(os.path.join(root, segment), block_offset, block_length):
+            yield (user,) + row
+
+
+# --- Перенос в архив ---
+def months_to_archive(conn, keep_months: int, now: datetime = None) -> list:
+    """Месяцы (год, месяц) по UTC с записями в moods, закончившиеся раньше, чем keep_months месяцев назад.
+    Таблица просматривается целиком: индекса по одному ts нет, чтобы не увеличивать горячую таблицу"""
+    now = now or datetime.now(timezone.utc)
+    months = now.year * 12 + now.month - 1 - keep_months
+    cutoff, _ = month_range_utc(months // 12, months % 12 + 1, 0)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DISTINCT CAST(strftime('%Y', ts, 'unixepoch') AS INTEGER),
+                        CAST(strftime('%m', ts, 'unixepoch') AS INTEGER)
+        FROM moods WHERE ts < ? ORDER BY 1, 2
+    ''', (cutoff,))
+    return cursor.fetchall()
+
+def archive_month(conn, archive_dir: str, year: int, month: int) -> int:
+    """Переносит записи месяца (по UTC) из moods в сегмент месяца. Возвращает число перенесённых записей.
+    Относительный archive_dir отсчитывается от каталога файла базы"""
+    start, end = month_range_utc(year, month, 0)
+    root = archive_root(conn)
+    segment = os.path.join(archive_dir, f"moods-{year:04d}-{month:02d}.seg")
+    os.makedirs(os.path.join(root, archive_dir), exist_ok=True)
+    # Блокировка записи берётся сразу: между выборкой и удалением в месяц не добавится новая запись
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''
+            SELECT user_id, id, ts, mood_id FROM moods
+            WHERE ts >= ? AND ts < ? ORDER BY user_id, ts, id
+        ''', (start, end)).fetchall()
+        manifest = []
+        with open(os.path.join(root, segment), "ab") as f:
+            for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+                user_rows = [row[1:] for row in user_rows]
+                block = encode_block(user_id, user_rows)
+                manifest.append((user_id, year, month, segment, f.tell(), len(block), len(user_rows)))
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        conn.executemany('''
+            INSERT INTO mood_archive (user_id, year, month, segment, block_offset, block_length, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', manifest)
+        conn.execute('DELETE FROM moods WHERE ts >= ? AND ts < ?', (start, end))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+def archive_closed_months(conn, archive_dir: str = "archive", keep_months: int = 12) -> dict:
+    """Переносит в архив все месяцы старше keep_months, каждый отдельной транзакцией.
+    Возвращает {(год, месяц): число перенесённых записей}"""
+    archived = {}
+    for year, month in months_to_archive(conn, keep_months):
+        archived[(year, month)] = archive_month(conn, archive_dir, year, month)
+        logger.info(f"В архив перенесено записей за {month:02d}.{year}: {archived[(year, month)]}")
+    return archived
+
+
+if __name__ == '__main__':
+    from add_mood_to_db import connect_db
+
+    logging.basicConfig(level=logging.INFO)
+    conn = connect_db(sys.argv[1] if len(sys.argv) > 1 else 'mood_base.db')
+    archived = archive_closed_months(
+        conn,
+        archive_dir=sys.argv[3] if len(sys.argv) > 3 else 'archive',
+        keep_months=int(sys.argv[2]) if len(sys.argv) > 2 else 12,
+    )
+    print(f"Перенесено в архив записей: {sum(archived.values())} за {len(archived)} мес.")
+    if archived:
+        # Освободившиеся страницы moods возвращаются файлу базы только после VACUUM
+        conn.execute('VACUUM')
@@ -0,0 +1,37 @@
+from typing import NamedTuple
+
+
+class Mood(NamedTuple):
+    id: int      # mood_id в таблице moods
+    code: str    # часть callback_data после "mood_"
+    label: str   # подпись в истории и на графиках
+    button: str  # текст кнопки выбора настроения
+    valence: int # окраска для трендов и календаря: 1 - приятное, 0 - нейтральное, -1 - неприятное
+
+
+# Единый справочник настроений. Порядок задаёт mood_id, поэтому новые настроения добавляются только в конец
+MOODS = (
+    Mood(0, "positive", "Положительное 😊", "😊 Положительное", 1),
+    Mood(1, "tired", "Усталое 😩", "😩 Уставшее", -1),
+    Mood(2, "sad", "Грустное 😢", "😢 Грустное", -1),
+    Mood(3, "angry", "Злое 😠", "😠 Злое", -1),
+    Mood(4, "delighted", "Восхитительное 🤩", "🤩 Восхитительное", 1),
+    Mood(5, "irritated", "Раздражённое 😖", "😖 Раздражённое", -1),
+    Mood(6, "calm", "Спокойное 🙂", "🙂 Спокойное", 1),
+    Mood(7, "energetic", "Энергичное ⚡️", "⚡️ Энергичное", 1),
+    Mood(8, "anxious", "Тревожное 😰", "😰 Тревожное", -1),
+    Mood(9, "inspired", "Воодушевлённое 🤯", "🤯 Воодушевлённое", 1),
+    Mood(10, "bored", "Скучающее 🫠", "🫠 Скучающее", 0),
+    Mood(11, "loving", "Влюблённое 🥰", "🥰 Влюблённое", 1),
+    Mood(12, "indifferent", "Безразличное 🥱", "🥱 Безразличное", 0),
+    Mood(13, "scared", "Испуганное 😱", "😱 Испуганное", -1),
+    Mood(14, "proud", "Гордое 😎", "😎 Гордое", 1),
+    Mood(15, "envious", "Завистливое 😒", "😒 Завистливое", -1),
+    Mood(16, "confused", "Растерянное 😓", "😓 Растерянное", -1),
+    Mood(17, "playful", "Игривое 😏", "😏 Игривое", 1),
+    Mood(18, "focused", "Сосредоточенное 🤔", "🤔 Сосредоточенное", 0),
+    Mood(19, "sick", "Болезненное 🤧", "🤧 Болезненное", -1),
+)
+
+MOOD_BY_CODE = {mood.code: mood for mood in MOODS}
+MOOD_BY_ID = {mood.id: mood for mood in MOODS}
@@ -0,0 +1,184 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from heapq import merge
+from itertools import islice
+
+from add_mood_to_db import _rebuild_user_monthly_counts, bump_data_version
+from mood_archive import iter_archived, read_snapshot
+from mood_time import MSK_UTC_OFFSET
+
+# Форматы выгрузки: csv - таблица с заголовком, jsonl - по одному JSON-объекту на строку
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_FIELDS = ("time", "ts", "mood_id", "mood", "label")
+
+
+class ImportFormatError(ValueError):
+    """Загруженный файл не удалось прочитать как выгрузку настроений"""
+
+
+def detect_format(file_name: str) -> str:
+    """Формат по имени файла: moods.jsonl.gz / moods.json -> jsonl, всё остальное -> csv"""
+    return "jsonl" if ".json" in (file_name or "").lower() else "csv"
+
+
+def _iter_hot_moods(cursor, batch_size: int):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_user_moods(conn, user_id: int, batch_size: int = 1000):
+    """Записи пользователя от старых к новым: (ts, mood_id, code, label).
+    Строки читаются пачками через fetchmany, архивные - по одному месяцу, вся история в память не загружается"""
+    with read_snapshot(conn):
+        catalog = {mood_id: (code, label) for mood_id, code, label in conn.execute('SELECT id, code, label FROM mood_catalog')}
+        cursor = conn.execute('''
+            SELECT moods.ts, moods.id, moods.mood_id FROM moods
+            WHERE moods.user_id = ?
+            ORDER BY moods.ts, moods.id
+        ''', (user_id,))
+        archived = ((ts, id_, mood_id) for id_, ts, mood_id in iter_archived(conn, user_id))
+        # Архив и горячая таблица упорядочены по (ts, id) и сливаются в один поток
+        for ts, _, mood_id in merge(archived, _iter_hot_moods(cursor, batch_size)):
+            yield (ts, mood_id) + catalog[mood_id]
+
+
+def _export_records(conn, user_id: int, utc_offset: int):
+    tz = timezone(timedelta(seconds=utc_offset))
+    for ts, mood_id, code, label in iter_user_moods(conn, user_id):
+        yield {
+            "time": datetime.fromtimestamp(ts, tz).isoformat(),
+            "ts": ts,
+            "mood_id": mood_id,
+            "mood": code,
+            "label": label,
+        }
+
+
+def export_user_moods(conn, user_id: int, fmt: str = "csv", utc_offset: int = MSK_UTC_OFFSET) -> tuple:
+    """Выгружает историю пользователя в сжатый gzip документ в памяти. Возвращает (байты, число записей).
+    Записи по одной проходят от курсора через генератор прямо в gzip-поток"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    buffer = io.BytesIO()
+    count = 0
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        if fmt == "csv":
+            writer = csv.DictWriter(text, EXPORT_FIELDS)
+            writer.writeheader()
+            for record in _export_records(conn, user_id, utc_offset):
+                writer.writerow(record)
+                count += 1
+        else:
+            for record in _export_records(conn, user_id, utc_offset):
+                text.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        text.flush()
+        text.detach()
+    return buffer.getvalue(), count
+
+
+def _open_text(fileobj):
+    # Принимаются и сжатые (.gz), и обычные файлы: gzip узнаётся по первым байтам
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    if head == b"\x1f\x8b":
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+
+
+def _iter_records(text, fmt: str):
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def _parse_record(record, tz, known_ids: set, ids_by_code: dict):
+    """Запись выгрузки -> (ts, mood_id) или None, если её нельзя импортировать"""
+    if record is None:
+        return None
+    try:
+        if record.get("ts") not in (None, ""):
+            ts = int(record["ts"])
+        else:
+            moment = datetime.fromisoformat(record["time"])
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=tz)
+            ts = int(moment.timestamp())
+        if record.get("mood_id") not in (None, ""):
+            mood_id = int(record["mood_id"])
+        else:
+            mood_id = ids_by_code[record["mood"]]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if mood_id not in known_ids:
+        return None
+    return ts, mood_id
+
+
+def import_user_moods(conn, user_id: int, fileobj, fmt: str = "csv", utc_offset: int = MSK_UTC_OFFSET,
+                      chunk_size: int = 1000) -> dict:
+    """Загружает записи из выгрузки export_user_moods (csv или jsonl, можно в gzip) одной транзакцией.
+
+    Файл читается построчно, записи вставляются пачками по chunk_size через executemany.
+    Запись с тем же (user_id, ts), что уже есть в базе или выше в файле, пропускается - проверка
+    идёт по индексу (user_id, ts). Время без часового пояса считается местным временем пользователя.
+    Возвращает {"added": ..., "duplicates": ..., "invalid": ...}.
+    """
+    tz = timezone(timedelta(seconds=utc_offset))
+    ids_by_code = dict(conn.execute('SELECT code, id FROM mood_catalog'))
+    known_ids = set(ids_by_code.values())
+    added = duplicates = invalid = 0
+    months = set()
+
+    try:
+        records = _iter_records(_open_text(fileobj), fmt)
+        with conn:
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                parsed_chunk = [_parse_record(record, tz, known_ids, ids_by_code) for record in chunk]
+                valid = [parsed for parsed in parsed_chunk if parsed is not None]
+                invalid += len(parsed_chunk) - len(valid)
+                # Записи из архива тоже считаются уже загруженными; читаются только месяцы, которые задевает пачка
+                archived_ts = set()
+                if valid:
+                    chunk_ts = [parsed[0] for parsed in valid]
+                    archived_ts = {ts for _, ts, _ in iter_archived(conn, user_id, min(chunk_ts), max(chunk_ts) + 1)}
+                rows = []
+                for ts, mood_id in valid:
+                    if ts in archived_ts:
+                        duplicates += 1
+                    else:
+                        rows.append((user_id, ts, mood_id, user_id, ts))
+                before = conn.total_changes
+                conn.executemany('''
+                    INSERT INTO moods (user_id, ts, mood_id)
+                    SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM moods WHERE user_id = ? AND ts = ?)
+                ''', rows)
+                inserted = conn.total_changes - before
+                added += inserted
+                duplicates += len(rows) - inserted
+            if added:
+                months = _rebuild_user_monthly_counts(conn, user_id, utc_offset)
+    except (csv.Error, UnicodeDecodeError, OSError, EOFError) as e:
+        raise ImportFormatError(str(e)) from e
+
+    for year, month in months:
+        bump_data_version(user_id, year, month)
+    return {"added": added, "duplicates": duplicates, "invalid": invalid}
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+
+from add_mood_to_db import add_moods_batch
+from metrics import metrics
+from mood_time import MSK_UTC_OFFSET
+
+logger = logging.getLogger(__name__)
+
+# Режимы записи настроений
+IMMEDIATE = "immediate" # каждая запись - отдельная транзакция
+BATCHED = "batched"     # записи копятся в очереди и сохраняются пачками (group commit)
+
+
+class MoodIngestor:
+    """Буферизованная запись настроений в базу.
+
+    В режиме batched записи складываются в asyncio-очередь, а фоновая задача
+    сохраняет их через executemany одной транзакцией, как только набралось batch_size
+    записей или прошло flush_interval_ms миллисекунд с первой записи пачки.
+    add() возвращает управление только после коммита пачки, поэтому записанное
+    настроение не теряется, а тысячи нажатий в минуту напоминаний стоят десятки fsync, а не тысячи.
+    """
+
+    def __init__(self, db, mode: str = BATCHED, batch_size: int = 200, flush_interval_ms: int = 50):
+        if mode not in (IMMEDIATE, BATCHED):
+            raise ValueError(f"Неизвестный режим записи: {mode}")
+        self.db = db
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = asyncio.Queue()
+        self._task = None
+
+        # Счётчики для мониторинга
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        if self.mode == BATCHED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Пакетная запись настроений запущена: {self.batch_size} записей / {self.flush_interval * 1000:.0f} мс")
+
+    async def stop(self):
+        """Сохраняет всё, что осталось в очереди, и останавливает фоновую задачу. Вызывается при завершении бота"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        logger.info(f"Очередь записи настроений сброшена на диск: {self.stats()}")
+
+    async def add(self, user_id: int, mood_id: int, utc_offset: int = MSK_UTC_OFFSET):
+        """Записывает настроение и ждёт, пока оно будет сохранено в базе.
+        utc_offset - смещение пользователя от UTC в секундах, по нему запись попадает в месячные счётчики"""
+        row = (user_id, mood_id, int(time.time()), utc_offset)
+        if self._task is None:
+            await self._flush([row])
+            return
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, done))
+        await done
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush_pending(batch)
+
+        # Забираем записи, которые успели попасть в очередь после сигнала остановки
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                rest.append(item)
+        if rest:
+            await self._flush_pending(rest)
+
+    async def _flush_pending(self, batch: list):
+        try:
+            await self._flush([row for row, _ in batch])
+        except Exception as e:
+            logger.error(f"Не удалось сохранить пачку из {len(batch)} настроений: {e}")
+            for _, done in batch:
+                if not done.done():
+                    done.set_exception(e)
+            return
+        for _, done in batch:
+            if not done.done():
+                done.set_result(None)
+
+    async def _flush(self, rows: list):
+        started = time.perf_counter()
+        await self.db.write(add_moods_batch, rows)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("mood_flush_seconds", elapsed_ms / 1000)
+
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.last_batch_size = len(rows)
+        self.max_batch_size = max(self.max_batch_size, len(rows))
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        """Счётчики размера пачек и задержки сохранения"""
+        return {
+            "mode": self.mode,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "queue_size": self._queue.qsize(),
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.rows_written / self.flushes if self.flushes else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
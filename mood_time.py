@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+# Записи настроений хранят время как целое число секунд UTC (unix epoch).
+# Часовой пояс пользователя в users.time_zone задан относительно Москвы (UTC+3)
+MSK_UTC_OFFSET = 3 * 60 * 60
+LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+months_list = ["Январь", 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+
+def utc_offset_seconds(tz_offset) -> int:
+    """Смещение пользователя относительно МСК в часах (None - не выбрано, считается МСК) -> смещение от UTC в секундах"""
+    return MSK_UTC_OFFSET + (tz_offset or 0) * 60 * 60
+
+
+def to_local(ts: int, utc_offset: int) -> datetime:
+    return datetime.fromtimestamp(ts, timezone(timedelta(seconds=utc_offset)))
+
+
+def local_now(utc_offset: int) -> datetime:
+    return datetime.now(timezone(timedelta(seconds=utc_offset)))
+
+
+def format_local_time(ts: int, utc_offset: int) -> str:
+    """Время записи для показа пользователю в его часовом поясе"""
+    return to_local(ts, utc_offset).strftime(LEGACY_TIMESTAMP_FORMAT)
+
+
+def local_year_month(ts: int, utc_offset: int) -> tuple:
+    local = to_local(ts, utc_offset)
+    return local.year, local.month
+
+
+def month_range_utc(year: int, month: int, utc_offset: int) -> tuple:
+    """Границы месяца по местному времени пользователя в секундах UTC: [начало, конец)"""
+    tz = timezone(timedelta(seconds=utc_offset))
+    start = datetime(year, month, 1, tzinfo=tz)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=tz)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def parse_legacy_timestamp(text: str, source_utc_offset=None) -> int:
+    """Строка 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' из старой схемы -> секунды UTC.
+    Старые записи сделаны по локальному времени сервера; source_utc_offset (в секундах) задаёт его явно"""
+    local = datetime.strptime(text, LEGACY_TIMESTAMP_FORMAT)
+    if source_utc_offset is not None:
+        local = local.replace(tzinfo=timezone(timedelta(seconds=source_utc_offset)))
+    return int(local.timestamp())
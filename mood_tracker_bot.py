@@ -3,17 +3,28 @@ Python 3.13.3
 aiogram 3.19.0
 """
 
+import sys
+
+from startup_profile import StartupProfile, PROFILE_FLAG, profile_startup
+
+if __name__ == '__main__' and PROFILE_FLAG in sys.argv and "importtime" not in sys._xoptions:
+    # Этот процесс только запускает бота с -X importtime и печатает отчёт; тяжёлые импорты ниже не выполняются
+    sys.exit(profile_startup(__file__))
+startup = StartupProfile()
+
 import logging
 import asyncio
-from datetime import datetime, time
+import signal
+from datetime import time
 
 from aiogram import Bot, Dispatcher
-from aiogram.filters import CommandStart, Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types.input_file import FSInputFile
+from aiogram.types.input_file import BufferedInputFile
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -21,153 +32,353 @@ from apscheduler.triggers.cron import CronTrigger
 from dotenv import load_dotenv
 import os
 
-from add_mood_to_db import *
-from plot_visualisaion import make_and_save_plot
+from add_mood_to_db import (
+    count_user_moods,
+    get_all_notifications,
+    get_available_year_months,
+    get_data_version,
+    get_month_mood_counts,
+    get_month_chart_file,
+    get_mood_history_page,
+    get_notification_changes,
+    get_notification_seq,
+    get_user_data_version,
+    month_counts_version,
+    rebuild_user_monthly_counts,
+    save_chart_file,
+)
+from async_db import AsyncDatabase
+from mood_ingest import MoodIngestor
+from mood_archive import archive_month, months_to_archive
+from update_dedup import DedupMiddleware
+from chart_service import ChartRenderService, ChartQueueFull, ChartRenderError, ChartTimeout, render_month_chart, render_weekly_chart, render_heatmap_chart
+from chart_cache import ChartCache
+from reminders import ReminderWheel, shift_time_str
+from reminder_dispatch import ReminderDispatcher
+from session_cache import SessionCache
+from user_settings import UserSettingsRepository, local_notification_time
+from callback_router import CallbackRouter, ParsedCallback
+from mood_catalog import MOODS, MOOD_BY_CODE, MOOD_BY_ID
+from metrics import metrics, MetricsMiddleware
+from mood_time import utc_offset_seconds, local_now, format_local_time, months_list
+from migrations import apply_migrations
+from mood_export import export_user_moods, import_user_moods, detect_format, ImportFormatError
+from webhook_server import WebhookServer
+from bot_config import get_bot_token, get_admin_id
+
+startup.mark("импорт модулей")
 
 # --- Конфигурация ---
 # load_dotenv("config.env")
 # BOT_TOKEN = os.getenv('TOKEN')
 # ADMIN_ID = os.getenv('ADMINID')
-
-
-f = open("user_config.txt")
-BOT_TOKEN = f.readline().replace("TOKEN=", "").replace("\n", "")
-ADMIN_ID = f.readline().replace("ADMINID=", "")
-f.close()
-
-conn = connect_db()
-conn2 = connect_db(db_name="users.db")
+# Токен и id администратора читаются из user_config.txt при первом обращении (см. bot_config.py)
+
+# Запись настроений: "batched" - пачками с групповым коммитом, "immediate" - каждая запись сразу
+MOOD_WRITE_MODE = os.getenv("MOOD_WRITE_MODE", "batched")
+MOOD_BATCH_SIZE = int(os.getenv("MOOD_BATCH_SIZE", "200"))
+MOOD_FLUSH_INTERVAL_MS = int(os.getenv("MOOD_FLUSH_INTERVAL_MS", "50"))
+
+# Отрисовка графиков в отдельных процессах
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_QUEUE_LIMIT = int(os.getenv("CHART_QUEUE_LIMIT", "16"))
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "30"))
+CHART_CACHE_MB = int(os.getenv("CHART_CACHE_MB", "64"))
+# Движок отрисовки: "pillow" - быстрый, "matplotlib" - медленнее, с полной вёрсткой; формат картинок - png или webp
+CHART_RENDERER = os.getenv("CHART_RENDERER", "pillow")
+CHART_IMAGE_FORMAT = os.getenv("CHART_IMAGE_FORMAT", "png")
+
+# Рассылка напоминаний: сообщений в секунду (лимит Telegram около 30) и одновременных запросов
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "25"))
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "20"))
+
+# Кэш сессий пользователей: сколько держать в памяти и как долго
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "100000"))
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+
+# Импорт истории: Bot API отдаёт боту файлы не больше 20 МБ
+IMPORT_MAX_MB = int(os.getenv("IMPORT_MAX_MB", "20"))
+
+# Архив старых месяцев (mood_archive.py): раз в сутки записи месяцев старше ARCHIVE_AFTER_MONTHS
+# переносятся из moods в сжатые сегменты в каталоге ARCHIVE_DIR (относительный - от каталога mood_base.db).
+# 0 - не переносить
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Повторы обновлений: тот же update_id отбрасывается в течение DEDUP_UPDATE_TTL секунд, повторное нажатие
+# кнопки записи настроения или часового пояса на той же версии сообщения - в течение DEDUP_CALLBACK_TTL секунд
+DEDUP_UPDATE_TTL = float(os.getenv("DEDUP_UPDATE_TTL", "600"))
+DEDUP_CALLBACK_TTL = float(os.getenv("DEDUP_CALLBACK_TTL", "10"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+# Выгрузка метрик в формате Prometheus: в файл раз в METRICS_FILE_INTERVAL секунд и/или по HTTP на 127.0.0.1:METRICS_PORT
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = int(os.getenv("METRICS_FILE_INTERVAL", "15"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Получение обновлений: "polling" - long polling, "webhook" - HTTP-сервер на WEBHOOK_HOST:WEBHOOK_PORT.
+# WEBHOOK_URL - внешний адрес для регистрации вебхука в Telegram (пустой - не регистрировать, для локальной проверки).
+# Без WEBHOOK_SECRET вебхук запускается только на 127.0.0.1/localhost
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Сколько секунд при остановке ждать начатые обработчики и рассылки напоминаний
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+
+# Работа шардом под shard_supervisor.py: номер процесса, их число и рассылает ли этот процесс напоминания
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+REMINDER_OWNER = os.getenv("REMINDER_OWNER", "1") == "1"
+
+# Асинхронный доступ к базе: обработчики не блокируют цикл событий на время запросов.
+# Настройки пользователей и записи настроений лежат в одной базе (users.db переносится в неё миграцией)
+db = AsyncDatabase(db_name="mood_base.db")
+mood_ingestor = MoodIngestor(db, mode=MOOD_WRITE_MODE, batch_size=MOOD_BATCH_SIZE, flush_interval_ms=MOOD_FLUSH_INTERVAL_MS)
+chart_service = ChartRenderService(
+    workers=CHART_WORKERS, max_queue=CHART_QUEUE_LIMIT, timeout=CHART_TIMEOUT,
+    renderer=CHART_RENDERER, image_format=CHART_IMAGE_FORMAT
+)
+chart_cache = ChartCache(max_bytes=CHART_CACHE_MB * 1024 * 1024)
 
 
 # --- Логирование ---
-logging.basicConfig(level=logging.INFO)
+if SHARD_COUNT > 1:
+    logging.basicConfig(level=logging.INFO, format=f"%(levelname)s:shard{SHARD_INDEX}:%(name)s:%(message)s")
+else:
+    logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Хранилище данных (в памяти) ---
-# user_data = { user_id: {"moods": [(timestamp, mood_text)], "notification_time": "HH:MM"} }
-user_data = {}
-user_time_zone = None
+# Ограниченный кэш текущих настроек пользователей; история настроений хранится только в базе
+user_sessions = SessionCache(max_entries=SESSION_CACHE_SIZE, ttl_seconds=SESSION_TTL_HOURS * 60 * 60)
+user_settings = UserSettingsRepository(db, user_sessions)
 
 # --- Машина состояния ---
 class UserStates(StatesGroup):
     waiting_for_notification_time = State()
+    waiting_for_import_file = State()
 
 # --- Инициализация ---
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
-bot = Bot(token=BOT_TOKEN)
+# Бот создаётся в main(), когда нужен токен; тесты могут подставить свой заранее
+bot = None
 scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
 
 # --- Клавиатуры ---
+# Неизменяемые клавиатуры собираются один раз при запуске и переиспользуются в каждом ответе
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📝 Запись настроения", callback_data="record_mood")],
+    [InlineKeyboardButton(text="⏰ Настройка времени", callback_data="set_notification_time")],
+    [InlineKeyboardButton(text="📈 График настроения", callback_data="plot")]
+])
+
+MOOD_SELECTION_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=mood.button, callback_data=f"mood_{mood.code}")] for mood in MOODS
+])
+
 def get_main_menu_keyboard():
-    buttons = [
-        [InlineKeyboardButton(text="📝 Запись настроения", callback_data="record_mood")],
-        [InlineKeyboardButton(text="⏰ Настройка времени", callback_data="set_notification_time")],
-        [InlineKeyboardButton(text="📈 График настроения", callback_data="plot")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return MAIN_MENU_KEYBOARD
 
 def get_mood_selection_keyboard():
-    buttons = [
-        [InlineKeyboardButton(text="😊 Положительное", callback_data="mood_positive")],
-        [InlineKeyboardButton(text="😩 Уставшее", callback_data="mood_tired")],
-        [InlineKeyboardButton(text="😢 Грустное", callback_data="mood_sad")],
-        [InlineKeyboardButton(text="😠 Злое", callback_data="mood_angry")],
-        [InlineKeyboardButton(text="🤩 Восхитительное", callback_data="mood_delighted")],
-        [InlineKeyboardButton(text="😖 Раздражённое", callback_data="mood_irritated")],
-        [InlineKeyboardButton(text="🙂 Спокойное", callback_data="mood_calm")],
-        [InlineKeyboardButton(text="⚡️ Энергичное", callback_data="mood_energetic")],
-        [InlineKeyboardButton(text="😰 Тревожное", callback_data="mood_anxious")],
-        [InlineKeyboardButton(text="🤯 Воодушевлённое", callback_data="mood_inspired")],
-        [InlineKeyboardButton(text="🫠 Скучающее", callback_data="mood_bored")],
-        [InlineKeyboardButton(text="🥰 Влюблённое", callback_data="mood_loving")],
-        [InlineKeyboardButton(text="🥱 Безразличное", callback_data="mood_indifferent")],
-        [InlineKeyboardButton(text="😱 Испуганное", callback_data="mood_scared")],
-        [InlineKeyboardButton(text="😎 Гордое", callback_data="mood_proud")],
-        [InlineKeyboardButton(text="😒 Завистливое", callback_data="mood_envious")],
-        [InlineKeyboardButton(text="😓 Растерянное", callback_data="mood_confused")],
-        [InlineKeyboardButton(text="😏 Игривое", callback_data="mood_playful")],
-        [InlineKeyboardButton(text="🤔 Сосредоточенное", callback_data="mood_focused")],
-        [InlineKeyboardButton(text="🤧 Болезненное", callback_data="mood_sick")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return MOOD_SELECTION_KEYBOARD
+
+# Графики за длинный период под списком месяцев
+ANALYTICS_BUTTONS = [
+    [InlineKeyboardButton(text="📊 Тренд по неделям", callback_data="chart_weekly")],
+    [InlineKeyboardButton(text="🗓 Календарь за год", callback_data="chart_heatmap")],
+    [InlineKeyboardButton(text="📋 Итоги по годам", callback_data="chart_summary")],
+]
 
 def get_month_selection_keyboard(available_months: list):
-    """Создает клавиатуру для выбора месяца"""
-    months_list = ["Январь", 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+    """Создает клавиатуру для выбора месяца из списка пар (год, месяц)"""
     buttons = []
-    for month_num in available_months:
-        month_name = months_list[int(month_num) - 1]
-        buttons.append([InlineKeyboardButton(text=month_name, callback_data=f"month_{month_num}")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-def get_pagination_keyboard(current_page: int, total_pages: int, user_id: int):
-    """Создает клавиатуру для пагинации"""
+    for year, month_num in available_months:
+        month_name = f"{months_list[month_num - 1]} {year}"
+        buttons.append([InlineKeyboardButton(text=month_name, callback_data=f"month_{year}_{month_num}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons + ANALYTICS_BUTTONS)
+
+def get_pagination_keyboard(current_page: int, total_pages: int, first: tuple, last: tuple):
+    """Создает клавиатуру для пагинации. first и last - первая и последняя записи страницы (id, подпись, ts, ...).
+    В callback_data передаются id и время граничной записи, от которой ищется соседняя страница:
+    hist_{страница}_{n - новее / o - старше}_{id}_{ts}. По времени страница находится и тогда,
+    когда граничная запись уже перенесена в архив"""
     buttons = []
     if current_page > 0:
-        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page_{user_id}_{current_page-1}"))
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"hist_{current_page-1}_n_{first[0]}_{first[2]}"))
     if current_page < total_pages - 1:
-        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"page_{user_id}_{current_page+1}"))
+        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"hist_{current_page+1}_o_{last[0]}_{last[2]}"))
     return InlineKeyboardMarkup(inline_keyboard=[buttons])
 
 # --- Функции планировщика ---
 async def send_mood_prompt(user_id: int):
-    try:
-        await bot.send_message(
-            user_id,
-            "👋 Привет! Давай зафиксируем твоё настроение на сегодня.", reply_markup=get_mood_selection_keyboard() # или так, если хотите сразу выбор
-        )
-        logger.info(f"Отправлено напоминание пользователю {user_id}")
-    except Exception as e:
-        logger.error(f"Не удалось отправить напоминание пользователю {user_id}: {e}")
-        # Если пользователь заблокировал бота, то он удаляется из расписания
-        if "bot was blocked by the user" in str(e).lower():
-            remove_schedule(user_id)
-            if user_id in user_data:
-                del user_data[user_id]
-            logger.info(f"Пользователь {user_id} заблокировал бота. Задание и данные удалены.")
+    # Ошибки отправки обрабатывает ReminderDispatcher
+    await bot.send_message(
+        user_id,
+        "👋 Привет! Давай зафиксируем твоё настроение на сегодня.", reply_markup=get_mood_selection_keyboard() # или так, если хотите сразу выбор
+    )
 
+async def prune_blocked_user(user_id: int):
+    """Пользователь заблокировал бота: удаляем его из расписания и отключаем напоминания в базе"""
+    remove_schedule(user_id)
+    await user_settings.clear_notification(user_id)
+    logger.info(f"Пользователь {user_id} заблокировал бота. Задание и данные удалены.")
+
+reminder_dispatcher = ReminderDispatcher(
+    send_mood_prompt, prune_blocked_user, rate=REMINDER_RATE, max_in_flight=REMINDER_CONCURRENCY
+)
+reminder_wheel = ReminderWheel(reminder_dispatcher.dispatch)
+
+# Номер последнего изменения времени напоминаний, уже применённого к reminder_wheel
+reminder_seq = 0
+
+async def reminder_tick():
+    # При работе шардами время напоминаний меняют и другие процессы, поэтому перед тиком из базы
+    # читаются строки users, изменившиеся после reminder_seq: изменения не теряются и не рассылаются дважды
+    global reminder_seq
+    if SHARD_COUNT > 1:
+        changes = await db.read(get_notification_changes, reminder_seq)
+        if changes:
+            reminder_wheel.apply((user_id, time_str) for user_id, time_str, _ in changes)
+            reminder_seq = changes[-1][2]
+    await reminder_wheel.tick()
 
 def schedule_mood_prompt(user_id: int, time_str: str):
-    """Планирует или перепланирует ежедневное напоминание для пользователя."""
+    """Планирует или перепланирует ежедневное напоминание для пользователя (время по Москве)."""
     try:
-        hour, minute = map(int, time_str.split(':'))
-        job_id = f"mood_prompt_{user_id}"
-
-        # Удаляем старое задание, если оно есть
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-            logger.info(f"Старое задание {job_id} удалено.")
-
-        # Добавляем новое задание
-        scheduler.add_job(
-            send_mood_prompt,
-            trigger=CronTrigger(hour=hour, minute=minute, timezone="Europe/Moscow"), # Укажите ваш часовой пояс
-            args=[user_id],
-            id=job_id,
-            replace_existing=True
-        )
-        logger.info(f"Задание {job_id} установлено на {time_str} для пользователя {user_id}")
+        reminder_wheel.schedule(user_id, time_str)
+        logger.info(f"Напоминание установлено на {time_str} (МСК) для пользователя {user_id}")
         return True
     except ValueError:
         logger.error(f"Неверный формат времени: {time_str} для пользователя {user_id}")
         return False
-    except Exception as e:
-        logger.error(f"Ошибка при планировании задания для {user_id} на {time_str}: {e}")
-        return False
 
 def remove_schedule(user_id: int):
-    job_id = f"mood_prompt_{user_id}"
-    if scheduler.get_job(job_id):
-        scheduler.remove_job(job_id)
-        logger.info(f"Задание {job_id} удалено для пользователя {user_id}.")
+    if reminder_wheel.remove(user_id):
+        logger.info(f"Напоминание удалено для пользователя {user_id}.")
+
+# --- Графики ---
+async def get_month_chart(user_id: int, year: int, month: int, mood_counts: dict = None):
+    """Возвращает PNG диаграммы за месяц: из кэша, если данные месяца не менялись, иначе рисует заново.
+    Если записей за месяц нет, возвращает None"""
+    key = (user_id, year, month, get_data_version(user_id, year, month))
+    image = chart_cache.get(key)
+    if image is not None:
+        return image
+
+    if mood_counts is None:
+        mood_counts = await db.read(get_month_mood_counts, user_id, year, month)
+    if not mood_counts:
+        return None
+    image = await chart_service.render(render_month_chart, mood_counts, month, year)
+    chart_cache.put(key, image)
+    return image
+
+async def send_month_chart(chat_id: int, user_id: int, year: int, month: int, caption: str, reply_markup=None) -> bool:
+    """Отправляет диаграмму за месяц. Если такая же диаграмма уже отправлялась, она пересылается по file_id -
+    без отрисовки и загрузки в Telegram. Возвращает False, если записей за месяц нет"""
+    variant = f"{chart_service.renderer}.{chart_service.image_format}"
+    mood_counts, file_id = await db.read(get_month_chart_file, user_id, year, month, variant)
+    if not mood_counts:
+        return False
+    if file_id is not None:
+        try:
+            await bot.send_photo(chat_id, photo=file_id, caption=caption, reply_markup=reply_markup)
+            metrics.inc("month_chart_sent", source="file_id")
+            return True
+        except TelegramBadRequest as e:
+            # file_id другого бота (после смены токена) не принимается - диаграмма загружается заново
+            logger.warning(f"Не удалось отправить диаграмму по file_id пользователю {user_id}: {e}")
+
+    image = await get_month_chart(user_id, year, month, mood_counts)
+    photo = BufferedInputFile(image, filename=f"mood_plot_{year}_{month:02d}.{chart_service.image_format}")
+    sent = await bot.send_photo(chat_id, photo=photo, caption=caption, reply_markup=reply_markup)
+    metrics.inc("month_chart_sent", source="upload")
+    if sent.photo:
+        await db.write(save_chart_file, user_id, year, month, variant,
+                       month_counts_version(mood_counts), sent.photo[-1].file_id)
+    return True
+
+# --- Метрики ---
+def register_gauges():
+    metrics.gauge("chart_queue_depth", lambda: chart_service.queue_depth)
+    metrics.gauge("chart_cache_bytes", lambda: chart_cache.stats()["size_bytes"])
+    for name in ("items", "hits", "misses", "evictions"):
+        metrics.gauge(f"chart_cache_{name}", lambda name=name: chart_cache.stats()[name])
+    for name in ("size", "hits", "misses", "evictions", "expirations"):
+        metrics.gauge(f"session_cache_{name}", lambda name=name: user_sessions.stats()[name])
+    metrics.gauge("mood_ingest_queue_size", lambda: mood_ingestor.stats()["queue_size"])
+    metrics.gauge("mood_ingest_avg_batch_size", lambda: mood_ingestor.stats()["avg_batch_size"])
+    metrics.gauge("reminder_wheel_users", lambda: len(reminder_wheel))
+    metrics.gauge("dedup_update_keys", lambda: len(dedup.updates))
+    metrics.gauge("dedup_callback_keys", lambda: len(dedup.callbacks))
+
+def write_metrics_file():
+    """Записывает метрики целиком во временный файл и подменяет им старый, чтобы сборщик не прочитал половину"""
+    tmp_path = METRICS_FILE + ".tmp"
+    with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(metrics.render_prometheus())
+    os.replace(tmp_path, METRICS_FILE)
+
+async def start_metrics_server():
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://127.0.0.1:{METRICS_PORT}/metrics")
+    return runner
+
+async def get_analytics_chart(user_id: int, kind: str, utc_offset: int, year: int = None):
+    """PNG тренда по неделям (kind="weekly") или календаря за год (kind="heatmap"). None, если записей нет.
+    Данные считаются в потоке чтения базы, график рисуется в пуле процессов; результат кэшируется до новых записей.
+    Окно тренда и текущий год календаря заканчиваются сегодняшним днём, поэтому их ключ включает местную дату"""
+    today = local_now(utc_offset).date()
+    moving = kind == "weekly" or year == today.year
+    key = (user_id, kind, year, utc_offset, get_user_data_version(user_id), today if moving else None)
+    image = chart_cache.get(key)
+    if image is not None:
+        return image
+    # numpy нужен только для этих графиков и загружается при первом запросе, а не при запуске бота
+    from mood_analytics import weekly_trend_data, year_heatmap_data
+
+    if kind == "weekly":
+        data = await db.read(weekly_trend_data, user_id, utc_offset)
+        if data is None:
+            return None
+        image = await chart_service.render(render_weekly_chart, data)
+    else:
+        grid = await db.read(year_heatmap_data, user_id, utc_offset, year)
+        if grid is None:
+            return None
+        image = await chart_service.render(render_heatmap_chart, grid, year)
+    chart_cache.put(key, image)
+    return image
+
+def format_user_summary(summary: dict) -> str:
+    lines = ["📋 Итоги по годам:\n"]
+    for year in summary["years"]:
+        top_mood = MOOD_BY_ID.get(year["top_mood_id"])
+        lines.append(
+            f"{year['year']}: записей {year['records']}, дней с записями {year['days']}\n"
+            f"  приятных {year['positive_share']:.0%}, неприятных {year['negative_share']:.0%}\n"
+            f"  чаще всего: {top_mood.label if top_mood else year['top_mood_id']}\n"
+            f"  самая длинная серия: {year['longest_streak']} дн."
+        )
+    lines.append(f"\nТекущая серия: {summary['current_streak']} дн., рекорд: {summary['longest_streak']} дн.")
+    return "\n".join(lines)
 
 # --- Обработчики команд ---
 @dp.message(CommandStart())
 async def send_welcome(message: Message):
-    user_id = message.from_user.id
-    if user_id not in user_data:
-        user_data[user_id] = {"moods": [], "notification_time": None}
     await message.answer(
         f"👋 Привет, {message.from_user.full_name}!\n"
         "Я твой личный дневник настроения. Давай зафиксируем твоё состояние на сегодня.",
@@ -182,11 +393,17 @@ async def command_menu(message: Message):
     )
 
 # --- Обработчики колбэков ---
-@dp.callback_query(lambda c: c.data == "plot")
+callback_router = CallbackRouter()
+
+@dp.callback_query()
+async def route_callback(callback_query: CallbackQuery, state: FSMContext):
+    """Единая точка входа для всех колбэков: обработчик выбирается по callback_data через словарь"""
+    if not await callback_router.dispatch(callback_query, state=state):
+        await callback_query.answer()
+
+@callback_router.exact("plot")
 async def show_month_selection(callback_query: CallbackQuery):
-    from plot_visualisaion import get_available_months
-    
-    available_months = get_available_months(callback_query.from_user.id)
+    available_months = await db.read(get_available_year_months, callback_query.from_user.id)
     if not available_months:
         await callback_query.message.edit_text(
             "У вас пока нет записей настроения. Сначала сделайте несколько записей!",
@@ -201,24 +418,81 @@ async def show_month_selection(callback_query: CallbackQuery):
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("month_"))
-async def show_selected_month_plot(callback_query: CallbackQuery):
-    month = callback_query.data.split("_")[1]
-    year = str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))[:4]
-    months_list = ["Январь", 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    month_name = months_list[int(month) - 1]
+@callback_router.prefix("month")
+async def show_selected_month_plot(callback_query: CallbackQuery, parsed: ParsedCallback):
+    parts = parsed.payload.split("_")
+    if len(parts) > 1:
+        year, month = int(parts[0]), int(parts[1])
+    else: # Кнопки, отправленные до появления года в callback_data
+        settings = await user_settings.get(callback_query.from_user.id)
+        year, month = local_now(utc_offset_seconds(settings.tz_offset)).year, int(parts[0])
+    month_name = months_list[month - 1]
     
-    path_to_plot = make_and_save_plot(callback_query.from_user.id, month)
-    photo = FSInputFile(path_to_plot)
+    try:
+        sent = await send_month_chart(
+            callback_query.message.chat.id,
+            callback_query.from_user.id, year, month,
+            caption=f"Вот ваша диаграмма за {month_name} {year} год(а)",
+            reply_markup=get_main_menu_keyboard()
+        )
+    except (ChartQueueFull, ChartTimeout):
+        await callback_query.answer("Сейчас строится слишком много графиков, попробуйте через минуту.", show_alert=True)
+        return
+    except ChartRenderError:
+        await callback_query.answer("Не удалось построить график, попробуйте ещё раз.", show_alert=True)
+        return
+    if not sent:
+        await callback_query.answer(f"За {month_name} {year} записей нет.", show_alert=True)
+        return
+    await callback_query.answer()
+
+@callback_router.prefix("chart")
+async def show_analytics_chart(callback_query: CallbackQuery, parsed: ParsedCallback):
+    """chart_weekly, chart_heatmap[_год], chart_summary - графики и итоги за длинный период"""
+    user_id = callback_query.from_user.id
+    kind, _, year_str = parsed.payload.partition("_")
+    utc_offset = utc_offset_seconds((await user_settings.get(user_id)).tz_offset)
+
+    if kind == "summary":
+        from mood_analytics import user_summary
+        summary = await db.read(user_summary, user_id, utc_offset)
+        if not summary["years"]:
+            await callback_query.answer("У вас пока нет записей.", show_alert=True)
+            return
+        await callback_query.message.answer(format_user_summary(summary), reply_markup=get_main_menu_keyboard())
+        await callback_query.answer()
+        return
+
+    if kind not in ("weekly", "heatmap"):
+        await callback_query.answer()
+        return
+    year = int(year_str) if year_str else local_now(utc_offset).year
+    if kind == "heatmap" and not year_str:
+        # Без года в кнопке показывается последний год, в котором есть записи
+        available_months = await db.read(get_available_year_months, user_id)
+        if available_months:
+            year = available_months[-1][0]
+    try:
+        image = await get_analytics_chart(user_id, kind, utc_offset, year if kind == "heatmap" else None)
+    except (ChartQueueFull, ChartTimeout):
+        await callback_query.answer("Сейчас строится слишком много графиков, попробуйте через минуту.", show_alert=True)
+        return
+    except ChartRenderError:
+        await callback_query.answer("Не удалось построить график, попробуйте ещё раз.", show_alert=True)
+        return
+    if image is None:
+        await callback_query.answer("За этот период записей нет.", show_alert=True)
+        return
+    caption = "Ваше настроение по неделям за полгода" if kind == "weekly" else f"Ваш календарь настроения за {year} год"
     await bot.send_photo(
-        callback_query.message.chat.id, 
-        photo=photo, 
-        caption=f"Вот ваша диаграмма за {month_name} {year} год(а)",
+        callback_query.message.chat.id,
+        photo=BufferedInputFile(image, filename=f"mood_{kind}.{chart_service.image_format}"),
+        caption=caption,
         reply_markup=get_main_menu_keyboard()
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "record_mood")
+@callback_router.exact("record_mood")
 async def process_record_mood_callback(callback_query: CallbackQuery):
     await callback_query.message.edit_text(
         "Выбери какое у тебя сегодня настроение:",
@@ -226,45 +500,19 @@ async def process_record_mood_callback(callback_query: CallbackQuery):
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("mood_"))
-async def process_mood_selection_callback(callback_query: CallbackQuery):
+@callback_router.prefix("mood")
+async def process_mood_selection_callback(callback_query: CallbackQuery, parsed: ParsedCallback):
     user_id = callback_query.from_user.id
-    mood_choice_code = callback_query.data.split("_")[1]
-
-    mood_map = {
-        "positive": "Положительное 😊",
-        "tired": "Усталое 😩",
-        "sad": "Грустное 😢",
-        "angry": "Злое 😠",
-        "delighted": "Восхитительное 🤩",
-        "irritated": "Раздражённое 😖",
-        "calm": "Спокойное 🙂",
-        "energetic": "Энергичное ⚡️",
-        "anxious": "Тревожное 😰",
-        "inspired": "Воодушевлённое 🤯",
-        "bored": "Скучающее 🫠",
-        "loving": "Влюблённое 🥰",
-        "indifferent": "Безразличное 🥱",
-        "scared": "Испуганное 😱",
-        "proud": "Гордое 😎",
-        "envious": "Завистливое 😒",
-        "confused": "Растерянное 😓",
-        "playful": "Игривое 😏",
-        "focused": "Сосредоточенное 🤔",
-        "sick": "Болезненное 🤧"
-    }
-    mood_text = mood_map.get(mood_choice_code, "Неизвестное")
-
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    mood_ID = list(mood_map.keys()).index(mood_choice_code)
-
-    if user_id not in user_data:
-        user_data[user_id] = {"moods": [], "notification_time": None}
-
-    user_data[user_id]["moods"].append((timestamp, mood_text))
-    add_mood(conn, user_id=user_id, mood=mood_text, mood_id=mood_ID)
-    # conn.close()
+    mood = MOOD_BY_CODE.get(parsed.payload)
+    if mood is None:
+        await callback_query.answer("Неизвестное настроение")
+        return
+    mood_text = mood.label
+    mood_ID = mood.id
+
+    # Запись относится к месяцу по местному времени пользователя
+    settings = await user_settings.get(user_id)
+    await mood_ingestor.add(user_id=user_id, mood_id=mood_ID, utc_offset=utc_offset_seconds(settings.tz_offset))
 
     await callback_query.message.edit_text(
         f"Настроение '{mood_text}' записано!\nСпасибо! ✨",
@@ -280,12 +528,13 @@ async def process_mood_selection_callback(callback_query: CallbackQuery):
     )
 
 
-@dp.callback_query(lambda c: c.data == "set_notification_time")
+@callback_router.exact("set_notification_time")
 async def process_set_time_callback(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_for_notification_time)
     current_time_info = ""
-    if user_data.get(callback_query.from_user.id, {}).get("notification_time"):
-        current_time_info = f"\nТекущее установленное время: {user_data[callback_query.from_user.id]['notification_time']}"
+    current_time = local_notification_time(await user_settings.get(callback_query.from_user.id))
+    if current_time:
+        current_time_info = f"\nТекущее установленное время: {current_time}"
 
     await callback_query.message.edit_text(
         "🕒 В какое время (в формате ЧЧ:ММ, например, 09:30 или 18:05) "
@@ -312,30 +561,11 @@ async def process_time_input(message: Message, state: FSMContext):
         valid_time_str = parsed_time.strftime("%H:%M") # Приводим к HH:MM
         user_time = valid_time_str # Время, котолрое отобразиться у юзера в сообщении
 
-        plus_to_time = get_time_zone(conn2, user_id)
+        settings = await user_settings.get(user_id)
 
         # Перевод всего времени к Московскому
-        if plus_to_time == None: plus_to_time = "0"
-        new_hour = int(valid_time_str[:2]) - int(eval(plus_to_time))
-        if 0 <= new_hour <= 9: 
-            valid_time_str = "0" + str(new_hour) + valid_time_str[2:]
-        elif new_hour < 0: 
-            new_hour = 24 - abs(new_hour)
-            valid_time_str = str(new_hour) + valid_time_str[2:]
-        else:
-            valid_time_str = str(new_hour) + valid_time_str[2:]
-
-        # Проверка на наличие пользователя в базе
-        if check_user_in_table(conn=conn2, user_id=user_id) == False: # Ещё никого нет в базе
-            add_user_notification(conn=conn2, user_id=user_id, time=valid_time_str, time_zone=user_time_zone)
-        else:
-            if user_id in check_user_in_table(conn=conn2, user_id=user_id): # Пользователь есть в базе
-                update_time_notification(conn2, user_id, valid_time_str)
-            else: # Пользователя нет в базе
-                if user_time_zone == None:
-                    add_user_notification(conn=conn2, user_id=user_id, time=valid_time_str)
-                else:
-                    add_user_notification(conn=conn2, user_id=user_id, time=valid_time_str, time_zone=user_time_zone)
+        valid_time_str = shift_time_str(valid_time_str, -(settings.tz_offset or 0))
+        await user_settings.set_notification_time(user_id, valid_time_str)
 
         if schedule_mood_prompt(user_id, valid_time_str):
             await message.answer(
@@ -365,127 +595,306 @@ async def process_time_input(message: Message, state: FSMContext):
 # --- Команда для просмотра сохраненных данных (для отладки) ---
 @dp.message(Command("mydata"))
 async def show_my_data(message: Message):
-    all_moods = get_all_moods(conn)
     user_id = message.from_user.id
-    user_moods = [record for record in all_moods if record[0] == user_id]
+    last_moods = await db.read(get_mood_history_page, user_id, limit=5)
     
-    if not user_moods:
+    if not last_moods:
         await message.answer("У меня пока нет данных о вас.")
         return
 
     # Показываем последние 5 записей и кнопку для просмотра всех
+    utc_offset = utc_offset_seconds((await user_settings.get(user_id)).tz_offset)
     data_str = "Ваши последние 5 записей:\n\n"
-    five_moods = reversed(user_moods[-5:])
-    for record in five_moods:
-        data_str += f"  - {record[2]}: {record[1]}\n"
+    for record in last_moods:
+        data_str += f"  - {format_local_time(record[2], utc_offset)}: {record[1]}\n"
     
-    buttons = [[InlineKeyboardButton(text="📋 Показать все записи", callback_data=f"show_all_{user_id}_0")]]
+    buttons = [[InlineKeyboardButton(text="📋 Показать все записи", callback_data="hist_0")]]
     await message.answer(data_str, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
 
-@dp.callback_query(lambda c: c.data.startswith("show_all_"))
-async def show_all_records(callback_query: CallbackQuery):
-    parts = callback_query.data.split("_")
-    user_id = int(parts[2])
-    page = int(parts[3]) if len(parts) > 3 else 0
-    
-    all_moods = get_all_moods(conn)
-    user_moods = [record for record in all_moods if record[0] == user_id]
-    user_moods.reverse()  # Сортируем от новых к старым
-    
-    records_per_page = 30
-    total_pages = (len(user_moods) + records_per_page - 1) // records_per_page
-    
-    start_idx = page * records_per_page
-    end_idx = min(start_idx + records_per_page, len(user_moods))
-    
-    data_str = f"Ваши записи (страница {page + 1} из {total_pages}):\n\n"
-    for record in user_moods[start_idx:end_idx]:
-        data_str += f"  - {record[2]}: {record[1]}\n"
-    
-    keyboard = get_pagination_keyboard(page, total_pages, user_id)
-    await callback_query.message.edit_text(data_str, reply_markup=keyboard)
-    await callback_query.answer()
+# show_all_ и page_ - кнопки из старых сообщений, они открывают первую страницу
+@callback_router.prefix("hist", "show", "page")
+async def show_history_page(callback_query: CallbackQuery, parsed: ParsedCallback):
+    user_id = callback_query.from_user.id
+    page, direction, cursor_id, cursor_ts = 0, "older", None, None
+    if parsed.prefix == "hist":
+        parts = parsed.payload.split("_")
+        page = int(parts[0])
+        if len(parts) > 2:
+            direction = "newer" if parts[1] == "n" else "older"
+            cursor_id = int(parts[2])
+        if len(parts) > 3:
+            cursor_ts = int(parts[3])
 
-@dp.callback_query(lambda c: c.data.startswith("page_"))
-async def handle_pagination(callback_query: CallbackQuery):
-    parts = callback_query.data.split("_")
-    user_id = int(parts[1])
-    page = int(parts[2])
-    
-    all_moods = get_all_moods(conn)
-    user_moods = [record for record in all_moods if record[0] == user_id]
-    user_moods.reverse()  # Сортируем от новых к старым
-    
     records_per_page = 30
-    total_pages = (len(user_moods) + records_per_page - 1) // records_per_page
-    
-    start_idx = page * records_per_page
-    end_idx = min(start_idx + records_per_page, len(user_moods))
+    user_moods = await db.read(get_mood_history_page, user_id, cursor_id, direction, records_per_page, cursor_ts)
+    if not user_moods:
+        await callback_query.answer("Записей больше нет.")
+        return
+    total_records = await db.read(count_user_moods, user_id)
+    total_pages = (total_records + records_per_page - 1) // records_per_page
     
+    utc_offset = utc_offset_seconds((await user_settings.get(user_id)).tz_offset)
     data_str = f"Ваши записи (страница {page + 1} из {total_pages}):\n\n"
-    for record in user_moods[start_idx:end_idx]:
-        data_str += f"  - {record[2]}: {record[1]}\n"
+    for record in user_moods:
+        data_str += f"  - {format_local_time(record[2], utc_offset)}: {record[1]}\n"
     
-    keyboard = get_pagination_keyboard(page, total_pages, user_id)
+    keyboard = get_pagination_keyboard(page, total_pages, user_moods[0], user_moods[-1])
     await callback_query.message.edit_text(data_str, reply_markup=keyboard)
     await callback_query.answer()
 
+# --- Выгрузка и загрузка истории ---
+@dp.message(Command("export"))
+async def export_my_data(message: Message, command: CommandObject):
+    """/export или /export json - вся история одним сжатым файлом"""
+    user_id = message.from_user.id
+    fmt = "jsonl" if (command.args or "").strip().lower() in ("json", "jsonl") else "csv"
+    settings = await user_settings.get(user_id)
+    data, count = await db.read(export_user_moods, user_id, fmt, utc_offset_seconds(settings.tz_offset))
+    if not count:
+        await message.answer("У меня пока нет данных о вас.")
+        return
+    await message.answer_document(
+        BufferedInputFile(data, filename=f"moods_{user_id}.{fmt}.gz"),
+        caption=f"Ваши записи настроения: {count}. Этот файл можно загрузить обратно командой /import."
+    )
+
+@dp.message(Command("import"))
+async def ask_import_file(message: Message, state: FSMContext):
+    await state.set_state(UserStates.waiting_for_import_file)
+    await message.answer(
+        "📥 Пришлите файл, полученный командой /export (.csv, .jsonl или сжатый .gz). "
+        "Записи, которые уже есть, повторно не добавятся.\n\nДля отмены введите /cancel."
+    )
+
+@dp.message(UserStates.waiting_for_import_file)
+async def process_import_file(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    if message.text and message.text.strip().lower() == "/cancel":
+        await state.clear()
+        await message.answer("Загрузка отменена.", reply_markup=get_main_menu_keyboard())
+        return
+    if message.document is None:
+        await message.answer("Пришлите файл документом или введите /cancel.")
+        return
+    if (message.document.file_size or 0) > IMPORT_MAX_MB * 1024 * 1024:
+        await message.answer(f"Файл больше {IMPORT_MAX_MB} МБ, Telegram не даст его скачать.")
+        return
+
+    buffer = await bot.download(message.document)
+    settings = await user_settings.get(user_id)
+    try:
+        result = await db.write(
+            import_user_moods, user_id, buffer, detect_format(message.document.file_name),
+            utc_offset_seconds(settings.tz_offset)
+        )
+    except ImportFormatError as e:
+        logger.error(f"Не удалось прочитать файл импорта от {user_id}: {e}")
+        await message.answer("Не получилось прочитать файл. Пришлите выгрузку из /export или введите /cancel.")
+        return
+    await state.clear()
+    logger.info(f"Пользователь {user_id} загрузил историю: {result}")
+    await message.answer(
+        f"Готово! Добавлено записей: {result['added']}, уже были: {result['duplicates']}, "
+        f"не распознано: {result['invalid']}.",
+        reply_markup=get_main_menu_keyboard()
+    )
+
 # --- Команда для просмотра отчёта настроения в виде картинки ---
 @dp.message(Command("mood_plot"))
 async def show_my_mood_plot(message: Message):
-    year = str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))[:4]
-    months_list = ["Январь", 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    month = months_list[int(str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))[6:7]) - 1]
-    path_to_plot = make_and_save_plot(message.from_user.id, month)
-    photo = FSInputFile(path_to_plot)
-    await bot.send_photo(message.chat.id, photo=photo, caption=f"Вот ваша диаграмма за {month} {year} год(а)")
-
-
+    settings = await user_settings.get(message.from_user.id)
+    now = local_now(utc_offset_seconds(settings.tz_offset))
+    year = now.year
+    month = months_list[now.month - 1]
+    try:
+        sent = await send_month_chart(
+            message.chat.id, message.from_user.id, year, now.month, caption=f"Вот ваша диаграмма за {month} {year} год(а)"
+        )
+    except (ChartQueueFull, ChartTimeout):
+        await message.answer("Сейчас строится слишком много графиков, попробуйте через минуту.")
+        return
+    except ChartRenderError:
+        await message.answer("Не удалось построить график, попробуйте ещё раз.")
+        return
+    if not sent:
+        await message.answer(f"За {month} {year} записей пока нет.")
+
+
+
+TIMEZONES = [
+    {'label': 'МСК (UTC+3)', 'offset': 0},
+    {'label': 'МСК-1 (UTC+2)', 'offset': -1},
+    {'label': 'МСК+1 (UTC+4)', 'offset': 1},
+    {'label': 'МСК+2 (UTC+5)', 'offset': 2},
+    {'label': 'МСК+3 (UTC+6)', 'offset': 3},
+    {'label': 'МСК+4 (UTC+7)', 'offset': 4},
+    {'label': 'МСК+5 (UTC+8)', 'offset': 5},
+    {'label': 'МСК-2 (UTC+1)', 'offset': -2},
+    {'label': 'МСК-3 (UTC+0)', 'offset': -3},
+]
+TIMEZONE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=tz['label'], callback_data=f"timezone_{tz['offset']}")] for tz in TIMEZONES
+])
 
 def get_timezone_keyboard():
-    timezones = [
-        {'label': 'МСК (UTC+3)', 'offset': 0},
-        {'label': 'МСК-1 (UTC+2)', 'offset': -1},
-        {'label': 'МСК+1 (UTC+4)', 'offset': 1},
-        {'label': 'МСК+2 (UTC+5)', 'offset': 2},
-        {'label': 'МСК+3 (UTC+6)', 'offset': 3},
-        {'label': 'МСК+4 (UTC+7)', 'offset': 4},
-        {'label': 'МСК+5 (UTC+8)', 'offset': 5},
-        {'label': 'МСК-2 (UTC+1)', 'offset': -2},
-        {'label': 'МСК-3 (UTC+0)', 'offset': -3},
-    ]
-    keyboard = [ [InlineKeyboardButton(text=tz['label'], callback_data=f"timezone_{tz['offset']}")] for tz in timezones]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return TIMEZONE_KEYBOARD
 
 @dp.message(Command("set_timezone"))
 async def send_timezone_keyboard(message: Message):
     await message.answer("Пожалуйста, выберите ваш часовой пояс относительно МСК:", reply_markup=get_timezone_keyboard())
 
-@dp.callback_query(lambda c: c.data.startswith("timezone_"))
-async def handle_timezone_choice(callback: CallbackQuery):
-    global user_time_zone
-    offset = int(callback.data.split("_")[1])
-    user_time_zone = f"{offset:+d}"
-    await callback.answer(f"Вы выбрали часовой пояс: МСК{offset:+d}")
-    await callback.message.edit_text(f"Вы выбрали часовой пояс: МСК{offset:+d}")
-
-    # Проверка на наличие пользователя в базе
-    user_id = callback.from_user.id
-    if check_user_in_table(conn=conn2, user_id=user_id) == False: # Ещё никого нет в базе
-        pass
-    else:
-        if user_id in check_user_in_table(conn=conn2, user_id=user_id): # Пользователь есть в базе
-            update_time_zone(conn2, user_id, user_time_zone)
+@callback_router.prefix("timezone")
+async def handle_timezone_choice(callback_query: CallbackQuery, parsed: ParsedCallback):
+    offset = int(parsed.payload)
+    await callback_query.answer(f"Вы выбрали часовой пояс: МСК{offset:+d}")
+    await callback_query.message.edit_text(f"Вы выбрали часовой пояс: МСК{offset:+d}")
+
+    # Время напоминания хранится по Москве: при смене пояса оно сдвигается, чтобы по местному времени не измениться
+    new_time = await user_settings.set_time_zone(callback_query.from_user.id, offset)
+    if new_time:
+        schedule_mood_prompt(callback_query.from_user.id, new_time)
+    # Записи раскладываются по месяцам в местном времени, поэтому счётчики пользователя пересчитываются
+    await db.write(rebuild_user_monthly_counts, callback_query.from_user.id, utc_offset_seconds(offset))
+
+@dp.message(Command("stats"))
+async def show_stats(message: Message):
+    """Сводка задержек и очередей, только для администратора"""
+    if str(message.from_user.id) != get_admin_id():
+        return
+    await message.answer(metrics.summary_text())
+
+# Повторы отбрасываются раньше всех обработчиков и фильтров
+dedup = DedupMiddleware(update_ttl=DEDUP_UPDATE_TTL, callback_ttl=DEDUP_CALLBACK_TTL, max_entries=DEDUP_MAX_ENTRIES)
+dp.update.outer_middleware(dedup)
+# Время обработчиков колбэков записывается под именем обработчика из callback_router, а не route_callback
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware(name_resolver=lambda event: callback_router.handler_name(event.data)))
 
 # --- Главная функция ---
+async def run_webhook():
+    """Работает до SIGINT/SIGTERM, затем перестаёт принимать обновления и дожидается начатых обработчиков"""
+    server = WebhookServer(
+        lambda update: dp.feed_raw_update(bot, update), bot,
+        host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, url=WEBHOOK_URL,
+        drain_timeout=SHUTDOWN_TIMEOUT, allowed_updates=dp.resolve_used_update_types()
+    )
+    metrics.gauge("webhook_in_flight", lambda: server.in_flight)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, AttributeError):
+            # Windows: обработчиков сигналов в цикле событий нет, Ctrl+C отменяет main() через asyncio.run
+            pass
+    await server.start()
+    startup.mark("готов к приёму обновлений")
+    try:
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки")
+    finally:
+        await server.stop()
+
+async def load_reminders():
+    # Расписание напоминаний загружается из таблицы users целиком, поэтому переживает перезапуск бота.
+    # Номер изменения читается до строк: изменение между двумя чтениями применится ещё раз в reminder_tick
+    global reminder_seq
+    with startup.phase("загрузка напоминаний"):
+        reminder_seq = await db.read(get_notification_seq)
+        loaded = reminder_wheel.load(await db.read(get_all_notifications))
+    logger.info(f"Загружено напоминаний: {loaded}")
+
+    # Одно задание раз в минуту раздаёт напоминания из корзины этой минуты
+    scheduler.add_job(
+        reminder_tick,
+        trigger=CronTrigger(second=0),
+        id="reminder_wheel",
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=30,
+        replace_existing=True
+    )
+
+async def archive_old_months():
+    """Переносит закрытые месяцы в архив по одному: между месяцами успевают записаться новые настроения"""
+    for year, month in await db.read(months_to_archive, ARCHIVE_AFTER_MONTHS):
+        moved = await db.write(archive_month, ARCHIVE_DIR, year, month)
+        logger.info(f"В архив перенесено записей за {month:02d}.{year}: {moved}")
+
+async def warm_up():
+    """То, без чего можно начать принимать обновления: выполняется в фоне после запуска приёма.
+    Если график понадобится раньше, чем прогреется пул, его запуск просто подождёт прогрева"""
+    try:
+        with startup.phase("пул отрисовки графиков"):
+            await chart_service.start()
+    except Exception as e:
+        logger.error(f"Ошибка фонового запуска: {e}")
+
 async def main():
-    # Запуск планировщика
+    global bot
+    # Схема базы обновляется до последней версии; прерванная миграция продолжается при следующем запуске
+    applied = await db.write(
+        apply_migrations, legacy_users_db="users.db",
+        progress=lambda done: logger.info(f"Миграция времени записей: перенесено {done}")
+    )
+    if applied:
+        logger.info(f"Применены миграции базы: {applied}")
+    startup.mark("миграции базы")
+    await mood_ingestor.start()
+    if bot is None:
+        bot = Bot(token=get_bot_token())
+
+    register_gauges()
+    if METRICS_FILE:
+        scheduler.add_job(write_metrics_file, "interval", seconds=METRICS_FILE_INTERVAL, id="metrics_file", replace_existing=True)
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    if ARCHIVE_AFTER_MONTHS and REMINDER_OWNER:
+        # Архивирует один процесс - тот же, что рассылает напоминания
+        scheduler.add_job(
+            archive_old_months, trigger=CronTrigger(hour=4, minute=30), id="mood_archive",
+            coalesce=True, max_instances=1, replace_existing=True
+        )
+    # Расписание загружается до приёма обновлений: пользователь не изменит время напоминания, пока оно
+    # загружается, а если загрузить не удалось, процесс завершается с ошибкой, а не работает без напоминаний
+    if REMINDER_OWNER:
+        await load_reminders()
+    else:
+        logger.info("Напоминания рассылает другой шард")
+
     scheduler.start()
     logger.info("Планировщик запущен.")
+    startup.mark("планировщик и метрики")
+    warm_up_task = asyncio.create_task(warm_up())
 
     # Запуск бота
-    logger.info("Бот запускается...")
-    await dp.start_polling(bot)
+    logger.info(f"Бот запускается ({BOT_MODE}) через {startup.elapsed():.2f} с после старта процесса...")
+    try:
+        if startup.enabled:
+            # --profile-startup: обновления не принимаются, отчёт печатается после фонового прогрева
+            startup.mark("готов к приёму обновлений")
+            await warm_up_task
+            startup.emit()
+        elif BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            startup.mark("готов к приёму обновлений")
+            # Пока в Telegram зарегистрирован вебхук, getUpdates не работает
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if not warm_up_task.done():
+            warm_up_task.cancel()
+        # Новые напоминания не запускаются, начатые рассылки доводятся до конца
+        scheduler.shutdown(wait=False)
+        cancelled = await reminder_wheel.drain(SHUTDOWN_TIMEOUT)
+        if cancelled:
+            logger.warning(f"Прервано рассылок напоминаний при остановке: {cancelled}")
+        # Сохраняем накопленные записи настроений до закрытия соединений
+        await mood_ingestor.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        chart_service.shutdown()
+        db.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
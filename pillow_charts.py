@@ -0,0 +1,289 @@
+"""
+Быстрая отрисовка графиков на Pillow без matplotlib.
+
+Те же функции, что и в plot_visualisaion: render_mood_pie, render_weekly_trend, render_year_heatmap.
+Фигуры рисуются на холсте вдвое больше итогового и уменьшаются (сглаживание краёв), текст - уже на итоговом.
+Шрифты загружаются один раз на процесс, эмодзи из подписей убираются: в обычных шрифтах их нет.
+"""
+
+import importlib.util
+import io
+import math
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from mood_catalog import MOODS
+from mood_time import months_list
+
+SCALE = 2
+BACKGROUND = (255, 255, 255)
+TEXT_COLOR = (33, 33, 33)
+GRID_COLOR = (225, 225, 225)
+EMPTY_COLOR = (238, 238, 238)
+# Палитра tab20 из matplotlib, чтобы графики обоих движков выглядели похоже
+PALETTE = (
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+    "#aec7e8", "#ffbb78", "#98df8a", "#ff9896", "#c5b0d5", "#c49c94", "#f7b6d2", "#c7c7c7", "#dbdb8d", "#9edae5",
+)
+VALENCE_COLORS = ("#d9534f", "#bdbdbd", "#5cb85c")
+VALENCE_LABELS = ("Неприятные", "Нейтральные", "Приятные")
+# Опорные точки шкалы RdYlGn для календаря: окраска от -1 до 1
+HEATMAP_STOPS = ((-1.0, "#d73027"), (-0.5, "#fc8d59"), (0.0, "#ffffbf"), (0.5, "#91cf60"), (1.0, "#1a9850"))
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+EMOJI = re.compile("[\U0001F000-\U0001FFFF\u2600-\u27BF\uFE0F\u200D]")
+
+
+# --- Шрифты и цвета ---
+def _font_paths(bold: bool) -> list:
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    paths = [name]
+    # DejaVu есть в каждой установке matplotlib; find_spec находит пакет, не импортируя его
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is not None and spec.origin:
+        paths.append(os.path.join(os.path.dirname(spec.origin), "mpl-data", "fonts", "ttf", name))
+    return paths
+
+
+@lru_cache(maxsize=None)
+def get_font(size: int, bold: bool = False):
+    for path in _font_paths(bold):
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=None)
+def _rgb(color: str) -> tuple:
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def plain_label(label: str) -> str:
+    return EMOJI.sub("", label).strip()
+
+
+def _heatmap_color(value: float) -> tuple:
+    if value is None or math.isnan(value):
+        return EMPTY_COLOR
+    value = min(1.0, max(-1.0, value))
+    for (left, left_color), (right, right_color) in zip(HEATMAP_STOPS, HEATMAP_STOPS[1:]):
+        if value <= right:
+            share = (value - left) / (right - left)
+            return tuple(round(a + (b - a) * share) for a, b in zip(_rgb(left_color), _rgb(right_color)))
+    return _rgb(HEATMAP_STOPS[-1][1])
+
+
+def _text_color_on(color: tuple) -> tuple:
+    # Светлый текст на тёмном фоне и наоборот
+    return (255, 255, 255) if 0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2] < 150 else TEXT_COLOR
+
+
+# --- Холст ---
+def _new_canvas(width: int, height: int):
+    image = Image.new("RGB", (width * SCALE, height * SCALE), BACKGROUND)
+    return image, ImageDraw.Draw(image)
+
+
+def _finish(image) -> tuple:
+    """Уменьшает холст фигур до итогового размера и возвращает его вместе с ImageDraw для текста"""
+    image = image.reduce(SCALE)
+    return image, ImageDraw.Draw(image)
+
+
+def _encode(image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", quality=90, method=4)
+    else:
+        # В графике немного сплошных цветов: PNG с палитрой в разы меньше и кодируется быстрее полноцветного
+        image.quantize(256, method=Image.Quantize.FASTOCTREE).save(buffer, format="PNG", compress_level=6)
+    return buffer.getvalue()
+
+
+def _draw_title(draw, width: int, title: str):
+    font = get_font(22, bold=True)
+    draw.text((width // 2, 14), plain_label(title), font=font, fill=TEXT_COLOR, anchor="mt")
+
+
+def _nice_step(max_value: float, ticks: int = 5) -> float:
+    raw = max(max_value, 1) / ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 5, 10):
+        if raw <= factor * magnitude:
+            return max(1, factor * magnitude)
+    return 10 * magnitude
+
+
+# --- Графики ---
+def render_mood_pie(mood_counts: dict, title: str, image_format: str = "png") -> bytes:
+    """Круговая диаграмма по словарю {mood_id: count}: доли в секторах, подписи и число записей в легенде"""
+    width, height = 960, 640
+    slices = [(mood, mood_counts.get(mood.id, 0)) for mood in MOODS if mood_counts.get(mood.id, 0)]
+    total = sum(count for _, count in slices)
+
+    image, draw = _new_canvas(width, height)
+    radius = 250
+    cx, cy = 300, 350
+    box = [(cx - radius) * SCALE, (cy - radius) * SCALE, (cx + radius) * SCALE, (cy + radius) * SCALE]
+    start = -90.0
+    angles = []
+    for i, (mood, count) in enumerate(slices):
+        sweep = 360.0 * count / total
+        color = _rgb(PALETTE[i % len(PALETTE)])
+        draw.pieslice(box, start, start + sweep, fill=color)
+        angles.append((start + sweep / 2, count, color))
+        start += sweep
+    # Белые линии между секторами: дешевле, чем обводка каждого сектора
+    if len(slices) > 1:
+        for middle, count, _ in angles:
+            edge = math.radians(middle - 180.0 * count / total)
+            draw.line([cx * SCALE, cy * SCALE, (cx + radius * math.cos(edge)) * SCALE, (cy + radius * math.sin(edge)) * SCALE],
+                      fill=BACKGROUND, width=2 * SCALE)
+    image, draw = _finish(image)
+
+    _draw_title(draw, width, title)
+    percent_font = get_font(15, bold=True)
+    for middle, count, color in angles:
+        share = count / total
+        if share < 0.04:
+            continue
+        x = cx + radius * 0.66 * math.cos(math.radians(middle))
+        y = cy + radius * 0.66 * math.sin(math.radians(middle))
+        draw.text((x, y), f"{share:.1%}", font=percent_font, fill=_text_color_on(color), anchor="mm")
+
+    legend_font = get_font(16)
+    row = min(28, (height - 90) // max(len(slices), 1))
+    top = cy - row * len(slices) / 2
+    for i, (mood, count) in enumerate(slices):
+        y = top + i * row
+        draw.rectangle([590, y + 3, 606, y + 19], fill=_rgb(PALETTE[i % len(PALETTE)]))
+        draw.text((616, y + 11), f"{plain_label(mood.label)} - {count} ({count / total:.0%})",
+                  font=legend_font, fill=TEXT_COLOR, anchor="lm")
+    return _encode(image, image_format)
+
+
+def render_weekly_trend(week_starts, counts, days, rolling, title: str, image_format: str = "png") -> bytes:
+    """Столбцы записей по неделям с разбивкой по окраске и скользящая средняя окраска за 7 дней"""
+    width, height = 1200, 720
+    left, right = 70, width - 20
+    bars_top, bars_bottom = 90, 450
+    line_top, line_bottom = 500, 660
+
+    week_days = np.asarray(week_starts).astype("datetime64[D]").astype(np.int64)
+    day_numbers = np.asarray(days).astype("datetime64[D]").astype(np.int64)
+    first_day, last_day = int(week_days[0]), int(week_days[-1]) + 7
+    px_per_day = (right - left) / max(last_day - first_day, 1)
+    totals = counts.sum(axis=1)
+    step = _nice_step(float(totals.max()))
+    y_max = step * math.ceil(max(float(totals.max()), 1) / step)
+
+    def x_of(day):
+        return left + (day - first_day) * px_per_day
+
+    def bar_y(value):
+        return bars_bottom - (bars_bottom - bars_top) * value / y_max
+
+    def line_y(value):
+        return line_bottom - (line_bottom - line_top) * (value + 1) / 2
+
+    image, draw = _new_canvas(width, height)
+    for tick in np.arange(0, y_max + step / 2, step):
+        draw.line([left * SCALE, bar_y(tick) * SCALE, right * SCALE, bar_y(tick) * SCALE], fill=GRID_COLOR, width=SCALE)
+    for value in (-1, 0, 1):
+        draw.line([left * SCALE, line_y(value) * SCALE, right * SCALE, line_y(value) * SCALE],
+                  fill=(153, 153, 153) if value == 0 else GRID_COLOR, width=SCALE)
+
+    for week_day, week_counts in zip(week_days, counts):
+        x0, x1 = x_of(week_day) + 1, x_of(week_day + 6)
+        bottom = 0
+        for value, color in zip(week_counts, VALENCE_COLORS):
+            if value:
+                draw.rectangle([x0 * SCALE, bar_y(bottom + value) * SCALE, x1 * SCALE, bar_y(bottom) * SCALE], fill=_rgb(color))
+            bottom += value
+
+    # Линия прерывается на днях без данных (NaN)
+    segment = []
+    for day, value in zip(day_numbers, rolling):
+        if math.isnan(value):
+            if len(segment) > 1:
+                draw.line(segment, fill=_rgb("#337ab7"), width=3 * SCALE, joint="curve")
+            segment = []
+            continue
+        segment.append(((x_of(day) + 0.5) * SCALE, line_y(value) * SCALE))
+    if len(segment) > 1:
+        draw.line(segment, fill=_rgb("#337ab7"), width=3 * SCALE, joint="curve")
+    image, draw = _finish(image)
+
+    _draw_title(draw, width, title)
+    font = get_font(14)
+    for tick in np.arange(0, y_max + step / 2, step):
+        draw.text((left - 8, bar_y(tick)), f"{tick:g}", font=font, fill=TEXT_COLOR, anchor="rm")
+    for value, label in ((-1, "-1"), (0, "0"), (1, "1")):
+        draw.text((left - 8, line_y(value)), label, font=font, fill=TEXT_COLOR, anchor="rm")
+    draw.text((left, bars_top - 18), "Записей за неделю", font=font, fill=TEXT_COLOR, anchor="ls")
+    draw.text((left, line_top - 14), "Среднее за 7 дней", font=font, fill=TEXT_COLOR, anchor="ls")
+
+    label_every = max(1, math.ceil(len(week_days) / 13))
+    for i, week_day in enumerate(week_days):
+        if i % label_every == 0:
+            date = np.datetime64(int(week_day), "D").astype(object)
+            draw.text((x_of(week_day + 3), line_bottom + 10), date.strftime("%d.%m"), font=font, fill=TEXT_COLOR, anchor="mt")
+
+    legend_x = right
+    for color, label in reversed(list(zip(VALENCE_COLORS, VALENCE_LABELS))):
+        legend_x -= font.getlength(label) + 34
+        draw.rectangle([legend_x, bars_top - 30, legend_x + 14, bars_top - 16], fill=_rgb(color))
+        draw.text((legend_x + 20, bars_top - 23), label, font=font, fill=TEXT_COLOR, anchor="lm")
+    return _encode(image, image_format)
+
+
+def render_year_heatmap(grid, year: int, title: str, image_format: str = "png") -> bytes:
+    """Календарь года: клетка - день, цвет - средняя окраска настроения, серый - нет записей"""
+    rows, columns = grid.shape
+    cell, gap = 18, 3
+    left, top = 50, 80
+    width = left + columns * (cell + gap) + 40
+    height = top + rows * (cell + gap) + 70
+
+    image, draw = _new_canvas(width, height)
+    for week in range(columns):
+        for weekday in range(rows):
+            x = left + week * (cell + gap)
+            y = top + weekday * (cell + gap)
+            draw.rounded_rectangle([x * SCALE, y * SCALE, (x + cell) * SCALE, (y + cell) * SCALE],
+                                   radius=3 * SCALE, fill=_heatmap_color(float(grid[weekday, week])))
+    image, draw = _finish(image)
+
+    _draw_title(draw, width, title)
+    font = get_font(13)
+    for weekday, name in enumerate(WEEKDAYS):
+        draw.text((left - 8, top + weekday * (cell + gap) + cell / 2), name, font=font, fill=TEXT_COLOR, anchor="rm")
+
+    # Подписи месяцев над неделями, в которые попадает первое число
+    first_day = np.datetime64(f"{year}-01-01", "D")
+    grid_start = first_day - (first_day.astype(np.int64) + 3) % 7
+    month_starts = np.arange(f"{year}-01", f"{year + 1}-01", dtype="datetime64[M]").astype("datetime64[D]")
+    for name, week in zip(months_list, (month_starts - grid_start).astype(np.int64) // 7):
+        draw.text((left + week * (cell + gap), top - 8), name[:3], font=font, fill=TEXT_COLOR, anchor="ls")
+
+    legend_y = top + rows * (cell + gap) + 22
+    legend_x = left
+    for value, label in ((-1, "неприятно"), (0, "нейтрально"), (1, "приятно"), (float("nan"), "нет записей")):
+        draw.rectangle([legend_x, legend_y, legend_x + 14, legend_y + 14], fill=_heatmap_color(value))
+        draw.text((legend_x + 20, legend_y + 7), label, font=font, fill=TEXT_COLOR, anchor="lm")
+        legend_x += font.getlength(label) + 44
+    return _encode(image, image_format)
+
+
+def warm_up():
+    """Загружает шрифты и рисует пробную диаграмму, чтобы первый настоящий график не ждал"""
+    for size in (13, 14, 15, 16):
+        get_font(size)
+    get_font(22, bold=True)
+    render_mood_pie({MOODS[0].id: 1, MOODS[1].id: 1}, "warm up")
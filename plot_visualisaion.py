@@ -1,109 +1,124 @@
 import matplotlib.pyplot as plt
+import numpy as np
+import io
 import os
-from add_mood_to_db import connect_db, get_all_moods
+from datetime import datetime
+from add_mood_to_db import connect_db, get_month_mood_counts, get_available_year_months
+from mood_catalog import MOODS
+from mood_time import months_list
+from chart_renderers import get_renderer
 
-mood_map = {
-    "positive": "Положительное 😊",
-    "tired": "Усталое 😩",
-    "sad": "Грустное 😢",
-    "angry": "Злое 😠",
-    "delighted": "Восхитительное 🤩",
-    "irritated": "Раздражённое 😖",
-    "calm": "Спокойное 🙂",
-    "energetic": "Энергичное ⚡️",
-    "anxious": "Тревожное 😰",
-    "inspired": "Воодушевлённое 🤯",
-    "bored": "Скучающее 🫠",
-    "loving": "Влюблённое 🥰",
-    "indifferent": "Безразличное 🥱",
-    "scared": "Испуганное 😱",
-    "proud": "Гордое 😎",
-    "envious": "Завистливое 😒",
-    "confused": "Растерянное 😓",
-    "playful": "Игривое 😏",
-    "focused": "Сосредоточенное 🤔",
-    "sick": "Болезненное 🤧"
-}
+# Подписи настроений в порядке mood_id берутся из общего справочника
+mood_map = {mood.code: mood.label for mood in MOODS}
 
-mood_map_counter = {
-    "0": 0,
-    "1": 0,
-    "2": 0,
-    "3": 0,
-    "4": 0,
-    "5": 0,
-    "6": 0,
-    "7": 0,
-    "8": 0,
-    "9": 0,
-    "10": 0,
-    "11": 0,
-    "12": 0,
-    "13": 0,
-    "14": 0,
-    "15": 0,
-    "16": 0,
-    "17": 0,
-    "18": 0,
-    "19": 0
-}
+def render_mood_pie(mood_counts: dict, title: str, image_format: str = "png") -> bytes:
+    """Рисует круговую диаграмму по словарю {mood_id: count} и возвращает PNG (или image_format) в виде байтов"""
+    vals = []
+    labels_list = []
+    for mood_id, label in enumerate(mood_map.values()):
+        count = mood_counts.get(mood_id, 0)
+        if count:
+            vals.append(count)
+            labels_list.append(label)
 
-def make_and_save_plot(user_id: int, month: str):
-    """Функция, которая генерирует график настроения за определённый месяц и сохраняет его как изображение"""
-    conn = connect_db()
-    all_moods = get_all_moods(conn)
-    
-    # Reset counter for new calculation
-    for key in mood_map_counter:
-        mood_map_counter[key] = 0
-    
-    # Filter moods by month
-    for record in all_moods:
-        # Assuming record[2] contains the date in format YYYY-MM-DD
-        record_month = record[2].split('-')[1]  # Get month from date
-        if record_month == month:
-            mood_map_counter[str(record[3])] += 1
-    
-    conn.close()
+    labels = [x[:-2] for x in labels_list]
+    fig, ax = plt.subplots()
+    try:
+        ax.pie(vals, labels=labels, autopct='%1.1f%%')
+        ax.axis("equal")
+        ax.set_title(title, pad=19)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format, dpi=300)
+    finally:
+        # Без закрытия фигуры копятся в глобальном состоянии pyplot
+        plt.close(fig)
+    return buffer.getvalue()
 
-    months_list = ["Январь", 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    month_str = months_list[int(month) - 1]
+# Цвета и подписи групп настроений по окраске: неприятные, нейтральные, приятные
+VALENCE_COLORS = ("#d9534f", "#bdbdbd", "#5cb85c")
+VALENCE_LABELS = ("Неприятные", "Нейтральные", "Приятные")
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
 
-    value_list = []
-    name_of_mood_list = [] # Названия настроений, которых нет в БД
-    b = list(mood_map_counter.values())
-    for i in range(len(b)):
-        if b[i] == 0:
-            name_of_mood = list(mood_map.keys())[i]
-            name_of_mood_list.append(name_of_mood)
-        else: value_list.append(b[i])
+def _figure_to_bytes(fig, dpi: int, image_format: str = "png") -> bytes:
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format, dpi=dpi, bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
 
-    labels_list = []
-    for j in mood_map.items():
-        k, v = j
-        if k in name_of_mood_list: pass
-        else: labels_list.append(v)
+def render_weekly_trend(week_starts, counts, days, rolling, title: str, image_format: str = "png") -> bytes:
+    """Столбцы записей по неделям с разбивкой по окраске и скользящая средняя окраска за 7 дней"""
+    fig, (ax_weeks, ax_rolling) = plt.subplots(
+        2, 1, figsize=(10, 6), sharex=True, gridspec_kw={"height_ratios": [2, 1]}
+    )
+    bottom = np.zeros(len(week_starts))
+    for i, (color, label) in enumerate(zip(VALENCE_COLORS, VALENCE_LABELS)):
+        ax_weeks.bar(week_starts, counts[:, i], width=6, align="edge", bottom=bottom, color=color, label=label)
+        bottom += counts[:, i]
+    ax_weeks.set_ylabel("Записей за неделю")
+    ax_weeks.legend(loc="upper left")
+    ax_weeks.set_title(title)
 
-    vals = value_list
-    labels = [x[:-2] for x in labels_list]
+    ax_rolling.plot(days, rolling, color="#337ab7")
+    ax_rolling.axhline(0, color="#999999", linewidth=0.8)
+    ax_rolling.set_ylim(-1.05, 1.05)
+    ax_rolling.set_ylabel("Среднее за 7 дней")
+    fig.autofmt_xdate()
+    return _figure_to_bytes(fig, dpi=150, image_format=image_format)
+
+def render_year_heatmap(grid, year: int, title: str, image_format: str = "png") -> bytes:
+    """Календарь года: клетка - день, цвет - средняя окраска настроения, серый - нет записей"""
+    fig, ax = plt.subplots(figsize=(12, 2.6))
+    cmap = plt.get_cmap("RdYlGn").copy()
+    cmap.set_bad("#eeeeee")
+    image = ax.imshow(np.ma.masked_invalid(grid), cmap=cmap, vmin=-1, vmax=1)
+
+    # Подписи месяцев над неделями, в которые попадает первое число
+    first_day = np.datetime64(f"{year}-01-01", "D")
+    grid_start = first_day - (first_day.astype(np.int64) + 3) % 7
+    month_starts = np.arange(f"{year}-01", f"{year + 1}-01", dtype="datetime64[M]").astype("datetime64[D]")
+    ax.set_xticks(((month_starts - grid_start).astype(np.int64) // 7), [name[:3] for name in months_list])
+    ax.set_yticks(range(7), WEEKDAYS)
+    ax.tick_params(length=0)
+    ax.set_title(title)
+    fig.colorbar(image, ax=ax, ticks=[-1, 0, 1], fraction=0.02, pad=0.01).ax.set_yticklabels(["неприятно", "нейтрально", "приятно"])
+    return _figure_to_bytes(fig, dpi=150, image_format=image_format)
+
+def warm_up():
+    """Загружает кэш шрифтов и рендерера пробной отрисовкой до первого настоящего графика"""
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties())
     fig, ax = plt.subplots()
-    ax.pie(vals, labels=labels, autopct='%1.1f%%')
-    ax.axis("equal")
-    ax.set_title(month_str, pad=19)
-    plt.savefig(fr'monthly chart\{user_id}_mood_plot_{month_str}.png', dpi=300)
-    return fr'monthly chart\{user_id}_mood_plot_{month_str}.png'
+    try:
+        ax.pie([1, 1], labels=["a", "b"], autopct='%1.1f%%')
+        fig.canvas.draw()
+    finally:
+        plt.close(fig)
+
+def make_and_save_plot(user_id: int, month, year=None, renderer: str = "matplotlib"):
+    """Функция, которая генерирует график настроения пользователя за определённый месяц и сохраняет его как изображение.
+    renderer - движок отрисовки из chart_renderers.CHART_RENDERERS"""
+    month = int(month)
+    if year is None:
+        year = datetime.now().year
+    year = int(year)
 
-def get_available_months(user_id: int) -> list:
-    """Функция, которая возвращает список месяцев, в которых есть записи настроения"""
     conn = connect_db()
-    all_moods = get_all_moods(conn)
+    # Счётчики месяца читаются из mood_monthly_counts, которые обновляются вместе с каждой записью (ключ - user_id, год, месяц)
+    mood_counts = get_month_mood_counts(conn, user_id, year, month)
     conn.close()
-    
-    available_months = set()
-    for record in all_moods:
-        if record[0] == user_id:  # Check if record belongs to the user
-            month = record[2].split('-')[1]  # Get month from date
-            available_months.add(month)
-    
-    return sorted(list(available_months))
 
+    month_str = months_list[month - 1]
+    os.makedirs("monthly chart", exist_ok=True)
+    path_to_plot = os.path.join("monthly chart", f"{user_id}_mood_plot_{month_str}_{year}.png")
+    with open(path_to_plot, "wb") as f:
+        f.write(get_renderer(renderer).render_mood_pie(mood_counts, month_str))
+    return path_to_plot
+
+def get_available_months(user_id: int) -> list:
+    """Функция, которая возвращает список пар (год, месяц), в которых есть записи настроения пользователя"""
+    conn = connect_db()
+    available_months = get_available_year_months(conn, user_id)
+    conn.close()
+    return available_months
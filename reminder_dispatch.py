@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate отправок в секунду с запасом capacity на всплеск.
+    pause() останавливает выдачу токенов, когда Telegram просит подождать (RetryAfter)"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        # Ожидающие получают токены по очереди, а не все разом после паузы
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ReminderDispatcher:
+    """Массовая рассылка напоминаний с учётом ограничений Telegram.
+
+    Частота отправки ограничена общим TokenBucket (около 30 сообщений в секунду на бота),
+    одновременно выполняется не больше max_in_flight запросов. На RetryAfter вся рассылка
+    ставится на паузу на указанное Telegram время, и сообщение отправляется повторно.
+    Пользователи, заблокировавшие бота (TelegramForbiddenError), передаются в on_blocked.
+    """
+
+    def __init__(self, send, on_blocked, rate: float = 25, max_in_flight: int = 20, max_retries: int = 3):
+        # send(user_id) - корутина, отправляющая одно напоминание
+        # on_blocked(user_id) - корутина, удаляющая пользователя из рассылки
+        self.send = send
+        self.on_blocked = on_blocked
+        self.bucket = TokenBucket(rate)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+
+        self.sent = 0
+        self.retried = 0
+        self.blocked = 0
+        self.failed = 0
+        self.last_dispatch_size = 0
+        self.last_dispatch_seconds = 0.0
+        self.last_start_lag_seconds = 0.0
+
+    async def dispatch(self, user_ids: list, planned_at: float = None):
+        """Отправляет напоминания всем user_ids и возвращается, когда рассылка закончена"""
+        started = time.time()
+        if planned_at is not None:
+            self.last_start_lag_seconds = started - planned_at
+
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait((user_id, 0))
+
+        if planned_at is None:
+            planned_at = started
+        workers = [asyncio.create_task(self._worker(queue, planned_at)) for _ in range(min(self.max_in_flight, len(user_ids)))]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        self.last_dispatch_size = len(user_ids)
+        self.last_dispatch_seconds = time.time() - started
+        logger.info(f"Разослано напоминаний: {len(user_ids)} за {self.last_dispatch_seconds:.1f} с")
+
+    async def _worker(self, queue: asyncio.Queue, planned_at: float):
+        while True:
+            user_id, attempt = await queue.get()
+            try:
+                await self._send_one(queue, user_id, attempt, planned_at)
+            except Exception as e:
+                # Упавший исполнитель больше не берёт задания, и queue.join() в dispatch не дождался бы рассылки
+                self.failed += 1
+                logger.error(f"Ошибка рассылки напоминания пользователю {user_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _send_one(self, queue: asyncio.Queue, user_id: int, attempt: int, planned_at: float):
+        await self.bucket.acquire()
+        try:
+            await self.send(user_id)
+            self.sent += 1
+            # Насколько напоминание пришло позже запланированного времени
+            metrics.observe("reminder_send_lag_seconds", time.time() - planned_at)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой напоминаний")
+            self.bucket.pause(e.retry_after)
+            self._retry(queue, user_id, attempt)
+        except TelegramForbiddenError:
+            self.blocked += 1
+            metrics.inc("reminders_blocked")
+            try:
+                await self.on_blocked(user_id)
+            except Exception as e:
+                # Например, база занята: пользователь останется в рассылке до следующей попытки
+                self.failed += 1
+                logger.error(f"Не удалось отключить напоминания заблокировавшему бота пользователю {user_id}: {e}")
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning(f"Временная ошибка при отправке напоминания пользователю {user_id}: {e}")
+            self._retry(queue, user_id, attempt)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Не удалось отправить напоминание пользователю {user_id}: {e}")
+
+    def _retry(self, queue: asyncio.Queue, user_id: int, attempt: int):
+        metrics.inc("reminder_retries")
+        if attempt + 1 > self.max_retries:
+            self.failed += 1
+            logger.error(f"Напоминание пользователю {user_id} не отправлено после {self.max_retries} повторов")
+            return
+        self.retried += 1
+        queue.put_nowait((user_id, attempt + 1))
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "last_dispatch_size": self.last_dispatch_size,
+            "last_dispatch_seconds": self.last_dispatch_seconds,
+            "last_start_lag_seconds": self.last_start_lag_seconds,
+        }
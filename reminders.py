@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MINUTES_IN_DAY = 24 * 60
+# Время напоминаний в базе хранится по Москве (UTC+3, без перехода на летнее время)
+MSK_UTC_OFFSET_MINUTES = 3 * 60
+# Сколько пропущенных минут догоняем, если цикл событий надолго задержал тик
+MAX_CATCH_UP_MINUTES = 15
+
+
+def parse_time_minutes(time_str: str) -> int:
+    """'ЧЧ:ММ' -> минута суток. ValueError при неверном формате"""
+    hour, minute = map(int, time_str.split(':'))
+    if not (0 <= hour <= 24 and 0 <= minute < 60):
+        raise ValueError(f"Неверное время: {time_str}")
+    return (hour * 60 + minute) % MINUTES_IN_DAY
+
+
+def shift_time_str(time_str: str, hours: int) -> str:
+    """Сдвигает время 'ЧЧ:ММ' на hours часов с переходом через полночь"""
+    minutes = (parse_time_minutes(time_str) + hours * 60) % MINUTES_IN_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def msk_time_to_utc_minute(time_str: str) -> int:
+    """Время по Москве 'ЧЧ:ММ' -> минута суток по UTC"""
+    return (parse_time_minutes(time_str) - MSK_UTC_OFFSET_MINUTES) % MINUTES_IN_DAY
+
+
+class ReminderWheel:
+    """Колесо напоминаний: 1440 корзин, по одной на каждую минуту суток по UTC.
+
+    Вместо отдельного cron-задания на каждого пользователя планировщик раз в минуту вызывает tick(),
+    и напоминание получают все пользователи из корзины этой минуты. Накладные расходы планировщика
+    не зависят от числа пользователей, а перенос времени - это перенос id между двумя множествами.
+    """
+
+    def __init__(self, send_reminders):
+        # send_reminders(user_ids, planned_at) - корутина, рассылающая напоминания
+        self.send_reminders = send_reminders
+        self._buckets = [set() for _ in range(MINUTES_IN_DAY)]
+        self._user_minute = {}
+        self._last_tick = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._user_minute)
+
+    def load(self, rows) -> int:
+        """Загружает расписание из строк (user_id, notification_time). Возвращает число загруженных"""
+        loaded = 0
+        for user_id, time_str in rows:
+            try:
+                self.schedule(user_id, time_str)
+                loaded += 1
+            except ValueError:
+                logger.error(f"Неверное время напоминания {time_str} у пользователя {user_id}, пропущено")
+        return loaded
+
+    def apply(self, rows):
+        """Применяет изменения расписания (user_id, notification_time), сделанные другими процессами бота.
+        notification_time None - напоминание отключено"""
+        for user_id, time_str in rows:
+            if time_str is None:
+                self.remove(user_id)
+                continue
+            try:
+                self.schedule(user_id, time_str)
+            except ValueError:
+                logger.error(f"Неверное время напоминания {time_str} у пользователя {user_id}, пропущено")
+
+    def schedule(self, user_id: int, time_str: str):
+        """Ставит или переносит ежедневное напоминание. time_str - время по Москве"""
+        minute = msk_time_to_utc_minute(time_str)
+        self.remove(user_id)
+        self._buckets[minute].add(user_id)
+        self._user_minute[user_id] = minute
+
+    def remove(self, user_id: int) -> bool:
+        minute = self._user_minute.pop(user_id, None)
+        if minute is None:
+            return False
+        self._buckets[minute].discard(user_id)
+        return True
+
+    def due(self, minute_of_day: int) -> list:
+        return list(self._buckets[minute_of_day % MINUTES_IN_DAY])
+
+    async def tick(self):
+        """Вызывается раз в минуту. Рассылает напоминания текущей минуты и догоняет пропущенные"""
+        now = time.time()
+        now_minute = int(now // 60)
+        # Отставание тика от начала минуты, на которую он был запланирован
+        metrics.observe("reminder_tick_lag_seconds", now - now_minute * 60)
+        if self._last_tick is None or now_minute - self._last_tick > MAX_CATCH_UP_MINUTES:
+            first_minute = now_minute
+        else:
+            first_minute = self._last_tick + 1
+
+        for epoch_minute in range(first_minute, now_minute + 1):
+            user_ids = self.due(epoch_minute)
+            if not user_ids:
+                continue
+            # Рассылка идёт отдельной задачей, чтобы долгая отправка не задерживала следующий тик
+            task = asyncio.create_task(self.send_reminders(user_ids, epoch_minute * 60))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._last_tick = max(now_minute, self._last_tick or now_minute)
+
+    async def drain(self, timeout: float = None) -> int:
+        """Дожидается начатых рассылок при остановке бота. Возвращает число отменённых по таймауту"""
+        if not self._tasks:
+            return 0
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        return len(pending)
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+
+
+class UserSession:
+    """Текущие настройки пользователя, которые нужны обработчикам между апдейтами.
+    История настроений здесь не хранится - она лежит в базе"""
+    __slots__ = ("known", "notification_time", "tz_offset", "touched_at")
+
+    def __init__(self, known=False, notification_time=None, tz_offset=None):
+        self.known = known                          # есть ли строка пользователя в таблице users
+        self.notification_time = notification_time # время напоминания по Москве, 'ЧЧ:ММ'
+        self.tz_offset = tz_offset                  # смещение относительно МСК в часах, None - не выбрано
+        self.touched_at = time.monotonic()
+
+
+class SessionCache:
+    """Ограниченный кэш сессий пользователей с вытеснением LRU и сроком жизни ttl_seconds.
+
+    Размер не превышает max_entries, поэтому память не растёт с числом пользователей,
+    когда-либо писавших боту. Вытесненная сессия ничего не теряет: настройки восстанавливаются из базы.
+    """
+
+    def __init__(self, max_entries: int = 100_000, ttl_seconds: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, user_id: int):
+        session = self._sessions.get(user_id)
+        if session is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        if now - session.touched_at > self.ttl_seconds:
+            del self._sessions[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        session.touched_at = now
+        self._sessions.move_to_end(user_id)
+        self.hits += 1
+        return session
+
+    def put(self, user_id: int, session: UserSession) -> UserSession:
+        session.touched_at = time.monotonic()
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._sessions),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,351 @@
+"""
+Запуск бота несколькими процессами-шардами.
+
+Передний процесс получает обновления от Telegram (long polling или вебхук, как в BOT_MODE) и пересылает
+каждое в процесс-шард user_id % BOT_SHARDS. Шарды - обычный mood_tracker_bot.py в режиме вебхука
+на 127.0.0.1:SHARD_BASE_PORT + номер; у каждого свои соединения с общей базой в режиме WAL,
+свой пул отрисовки графиков и свои кэши. Все обновления пользователя попадают в один и тот же шард,
+поэтому его сессия, состояние диалога и кэш графиков остаются согласованными.
+
+Напоминания рассылает только шард 0: он перечитывает расписание из базы перед каждым тиком.
+Упавший шард перезапускается; обновления на время перезапуска не теряются - пересылка повторяется.
+
+При long polling у каждого шарда своя ограниченная очередь и своя задача пересылки: медленный или
+перезапускающийся шард задерживает только свои обновления, а порядок обновлений одного пользователя
+сохраняется. Обновление, которое не удалось переслать за SHARD_FORWARD_ATTEMPTS попыток, отбрасывается
+(метрика shard_updates_dropped), чтобы не держать очередь шарда. Метрики переднего процесса пишутся
+в METRICS_FILE.front.
+
+Пример:
+    BOT_SHARDS=4 python shard_supervisor.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from add_mood_to_db import connect_db
+from bot_config import get_bot_token
+from metrics import metrics
+from migrations import apply_migrations
+from webhook_server import WebhookServer
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", str(os.cpu_count() or 1)))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))
+# Сколько секунд повторять пересылку, пока шард запускается или перезапускается
+SHARD_FORWARD_TIMEOUT = float(os.getenv("SHARD_FORWARD_TIMEOUT", "15"))
+# Сколько раз по SHARD_FORWARD_TIMEOUT пытаться переслать обновление из очереди, прежде чем отбросить его
+SHARD_FORWARD_ATTEMPTS = int(os.getenv("SHARD_FORWARD_ATTEMPTS", "3"))
+# Обновлений в очереди одного шарда при long polling; когда очередь полна, получение обновлений ждёт
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# Сколько секунд ждать, пока все шарды запустятся и начнут принимать обновления
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", "120"))
+# Процессов отрисовки графиков на шард (по умолчанию один: шардов и так по числу ядер)
+SHARD_CHART_WORKERS = os.getenv("SHARD_CHART_WORKERS", "1")
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = int(os.getenv("METRICS_FILE_INTERVAL", "15"))
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:front:%(name)s:%(message)s")
+logger = logging.getLogger(__name__)
+
+
+def shard_for_user(user_id: int, shard_count: int) -> int:
+    return user_id % shard_count
+
+
+def update_user_id(update: dict):
+    """id пользователя, от которого пришло обновление (from/user/chat во вложенном объекте), или None"""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            owner = value.get(field)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return None
+
+
+class ShardSupervisor:
+    """Запускает процессы-шарды, перезапускает упавшие и пересылает им обновления по user_id"""
+
+    def __init__(self, count: int, base_port: int = 8100, forward_timeout: float = 15,
+                 shutdown_timeout: float = 30, script: str = "mood_tracker_bot.py",
+                 queue_size: int = 1000, forward_attempts: int = 3):
+        self.count = count
+        self.base_port = base_port
+        self.forward_timeout = forward_timeout
+        self.queue_size = queue_size
+        self.forward_attempts = forward_attempts
+        self.shutdown_timeout = shutdown_timeout
+        self.script = os.path.join(PROJECT_DIR, script)
+        # Шарды слушают только 127.0.0.1, секрет не даёт принять обновление от чужого локального процесса
+        self.secret = secrets.token_urlsafe(24)
+
+        self._processes = [None] * count
+        self._session = None
+        self._watch_task = None
+        self._queues = []
+        self._forwarders = []
+        self._stopping = False
+        self.forwarded = [0] * count
+        self.dropped = [0] * count
+        self.restarts = 0
+
+    def worker_env(self, index: int) -> dict:
+        env = dict(os.environ)
+        env.update(
+            SHARD_INDEX=str(index),
+            SHARD_COUNT=str(self.count),
+            # Владелец расписания один, поэтому напоминания не дублируются
+            REMINDER_OWNER="1" if index == 0 else "0",
+            BOT_MODE="webhook",
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(self.base_port + index),
+            WEBHOOK_PATH="/webhook",
+            WEBHOOK_SECRET=self.secret,
+            WEBHOOK_URL="",
+        )
+        env.setdefault("CHART_WORKERS", SHARD_CHART_WORKERS)
+        # Порт и файл метрик у каждого шарда свои
+        if env.get("METRICS_PORT", "0") != "0":
+            env["METRICS_PORT"] = str(int(env["METRICS_PORT"]) + index)
+        if env.get("METRICS_FILE"):
+            env["METRICS_FILE"] = f"{env['METRICS_FILE']}.shard{index}"
+        return env
+
+    async def _spawn(self, index: int):
+        # Своя группа процессов: Ctrl+C получает только супервизор, а он останавливает шарды по очереди
+        self._processes[index] = await asyncio.create_subprocess_exec(
+            sys.executable, self.script, env=self.worker_env(index), cwd=os.getcwd(),
+            start_new_session=hasattr(os, "killpg")
+        )
+        logger.info(f"Шард {index} запущен, pid {self._processes[index].pid}, порт {self.base_port + index}")
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        for index in range(self.count):
+            await self._spawn(index)
+        self._watch_task = asyncio.create_task(self._watch())
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.count)]
+        self._forwarders = [asyncio.create_task(self._forward_queue(index)) for index in range(self.count)]
+        for index, queue in enumerate(self._queues):
+            metrics.gauge("shard_queue_size", queue.qsize, shard=str(index))
+
+    async def wait_ready(self, timeout: float = 120):
+        """Ждёт, пока каждый шард ответит 200 на /healthz, чтобы первые обновления не ушли в пустоту"""
+        deadline = time.monotonic() + timeout
+        for index in range(self.count):
+            url = f"http://127.0.0.1:{self.base_port + index}/healthz"
+            while True:
+                try:
+                    async with self._session.get(url) as response:
+                        if response.status == 200:
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"шард {index} не запустился за {timeout} с")
+                await asyncio.sleep(0.2)
+        logger.info(f"Все шарды готовы: {self.count}")
+
+    async def _watch(self):
+        while not self._stopping:
+            for index, process in enumerate(self._processes):
+                if process.returncode is not None and not self._stopping:
+                    logger.error(f"Шард {index} завершился с кодом {process.returncode}, перезапуск")
+                    self.restarts += 1
+                    if hasattr(os, "killpg"):
+                        # Процессы отрисовки графиков упавшего шарда остались без родителя
+                        try:
+                            os.killpg(process.pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    await self._spawn(index)
+            await asyncio.sleep(1)
+
+    def shard_index(self, update: dict) -> int:
+        user_id = update_user_id(update)
+        return shard_for_user(user_id, self.count) if user_id is not None else 0
+
+    async def forward(self, update: dict):
+        """Пересылает обновление в шард пользователя. Повторяет, пока шард не ответит или не истечёт forward_timeout"""
+        index = self.shard_index(update)
+        url = f"http://127.0.0.1:{self.base_port + index}/webhook"
+        body = json.dumps(update)
+        deadline = time.monotonic() + self.forward_timeout
+        delay = 0.1
+        while True:
+            try:
+                async with self._session.post(url, data=body, headers={
+                    "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret
+                }) as response:
+                    if response.status == 200:
+                        self.forwarded[index] += 1
+                        return
+                    error = f"ответ {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError(f"шард {index} недоступен: {error}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def enqueue(self, update: dict):
+        """Ставит обновление в очередь его шарда. Ждёт, только если очередь этого шарда заполнена"""
+        await self._queues[self.shard_index(update)].put(update)
+
+    async def _forward_queue(self, index: int):
+        queue = self._queues[index]
+        while True:
+            update = await queue.get()
+            try:
+                for attempt in range(1, self.forward_attempts + 1):
+                    try:
+                        await self.forward(update)
+                        break
+                    except RuntimeError as e:
+                        logger.error(f"Обновление {update.get('update_id')} не переслано (попытка {attempt}): {e}")
+                else:
+                    self.dropped[index] += 1
+                    metrics.inc("shard_updates_dropped", shard=str(index))
+                    logger.error(f"Обновление {update.get('update_id')} отброшено: шард {index} недоступен")
+            finally:
+                queue.task_done()
+
+    async def _drain(self):
+        # Обновления, смещение которых уже подтверждено, пересылаются до остановки шардов
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не пересланы при остановке: {[queue.qsize() for queue in self._queues]}")
+        for forwarder in self._forwarders:
+            forwarder.cancel()
+        await asyncio.gather(*self._forwarders, return_exceptions=True)
+
+    async def stop(self):
+        """SIGTERM всем шардам: каждый дорабатывает начатые обновления и рассылки, затем процесс завершается"""
+        await self._drain()
+        self._stopping = True
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.shutdown_timeout + 5)
+            except asyncio.TimeoutError:
+                logger.warning(f"Шард {index} не завершился вовремя, принудительная остановка")
+                process.kill()
+                await process.wait()
+        if self._session is not None:
+            await self._session.close()
+        logger.info(
+            f"Шарды остановлены, переслано обновлений: {self.forwarded}, отброшено: {self.dropped}, перезапусков: {self.restarts}"
+        )
+
+
+async def poll_updates(bot: Bot, supervisor: ShardSupervisor):
+    """Long polling в переднем процессе. Обновления раскладываются по очередям шардов; смещение подтверждается
+    после постановки в очередь, недоставленное к остановке пересылается в supervisor.stop()"""
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await supervisor.enqueue(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def write_metrics_file(path: str, interval: float):
+    """Метрики переднего процесса (очереди шардов, отброшенные обновления) в файл раз в interval секунд"""
+    while True:
+        await asyncio.sleep(interval)
+        with open(path + ".tmp", "w") as metrics_file:
+            metrics_file.write(metrics.render_prometheus())
+        os.replace(path + ".tmp", path)
+
+
+async def main():
+    # Миграции выполняются один раз до запуска шардов, чтобы процессы не применяли их одновременно
+    conn = connect_db("mood_base.db")
+    try:
+        applied = apply_migrations(conn, legacy_users_db="users.db")
+        if applied:
+            logger.info(f"Применены миграции базы: {applied}")
+    finally:
+        conn.close()
+
+    bot = Bot(token=get_bot_token())
+    supervisor = ShardSupervisor(
+        BOT_SHARDS, base_port=SHARD_BASE_PORT, forward_timeout=SHARD_FORWARD_TIMEOUT, shutdown_timeout=SHUTDOWN_TIMEOUT,
+        queue_size=SHARD_QUEUE_SIZE, forward_attempts=SHARD_FORWARD_ATTEMPTS
+    )
+    await supervisor.start()
+    metrics_writer = asyncio.create_task(write_metrics_file(f"{METRICS_FILE}.front", METRICS_FILE_INTERVAL)) if METRICS_FILE else None
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, AttributeError):
+            # Windows: Ctrl+C отменяет main() через asyncio.run
+            pass
+
+    logger.info(f"Бот запускается: {BOT_SHARDS} шард(а/ов), получение обновлений - {BOT_MODE}")
+    server = None
+    polling = None
+    try:
+        await supervisor.wait_ready(SHARD_START_TIMEOUT)
+        if BOT_MODE == "webhook":
+            # Передний сервер отвечает Telegram только после пересылки, поэтому обновление не теряется
+            server = WebhookServer(
+                supervisor.forward, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET, url=WEBHOOK_URL, drain_timeout=SHUTDOWN_TIMEOUT, background=False
+            )
+            await server.start()
+        else:
+            polling = asyncio.create_task(poll_updates(bot, supervisor))
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки")
+    finally:
+        if server is not None:
+            await server.stop()
+        if polling is not None:
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+            await bot.session.close()
+        await supervisor.stop()
+        if metrics_writer is not None:
+            metrics_writer.cancel()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
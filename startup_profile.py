@@ -0,0 +1,116 @@
+"""
+Профиль запуска бота: python mood_tracker_bot.py --profile-startup
+
+Бот запускается дочерним процессом с -X importtime, проходит все этапы запуска (включая фоновые),
+но вместо приёма обновлений печатает отчёт: сколько длился каждый этап от старта процесса
+и какие импорты заняли больше всего времени.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+PROFILE_FLAG = "--profile-startup"
+# Время запуска дочернего процесса, чтобы в отчёт попал и старт интерпретатора
+START_TIME_ENV = "STARTUP_PROFILE_T0"
+REPORT_PREFIX = "STARTUP_PROFILE "
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+class StartupProfile:
+    """Этапы запуска в секундах от старта процесса.
+
+    mark(name) закрывает этап, начавшийся в конце предыдущего mark; phase(name) - отдельный этап,
+    который может идти параллельно с другими (например, прогрев в фоне после начала приёма обновлений).
+    """
+
+    def __init__(self):
+        self.started = float(os.environ.get(START_TIME_ENV) or time.time())
+        self.phases = []      # (название, начало, конец, фоновый)
+        self._last_mark = self.started
+
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    def mark(self, name: str):
+        now = time.time()
+        self.phases.append((name, self._last_mark - self.started, now - self.started, False))
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str, background: bool = True):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, begin - self.started, time.time() - self.started, background))
+
+    @property
+    def enabled(self) -> bool:
+        # Отчёт нужен только в дочернем процессе, запущенном profile_startup
+        return PROFILE_FLAG in sys.argv and "importtime" in sys._xoptions
+
+    def emit(self):
+        print(REPORT_PREFIX + json.dumps(self.phases, ensure_ascii=False), flush=True)
+
+
+def _parse_imports(stderr: str) -> list:
+    """Строки -X importtime -> [(модуль, собственное время, с вложенными, глубина)] в секундах.
+    Процессы отрисовки графиков наследуют -X importtime и пишут в тот же stderr, поэтому модуль,
+    импортированный в нескольких процессах, учитывается один раз"""
+    imports = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.setdefault(name, (name, int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent) // 2))
+    return list(imports.values())
+
+
+def format_report(phases: list, imports: list, top: int = 15) -> str:
+    lines = []
+    foreground = [phase for phase in phases if not phase[3]]
+    background = [phase for phase in phases if phase[3]]
+    if foreground:
+        lines.append(f"Готов к приёму обновлений через {foreground[-1][2]:.3f} с от запуска процесса")
+    lines.append(f"{'этап':<40}{'начало, с':>11}{'длит., с':>11}")
+    for name, begin, end, _ in foreground:
+        lines.append(f"{name:<40}{begin:>11.3f}{end - begin:>11.3f}")
+    if background:
+        lines.append("В фоне после начала приёма обновлений:")
+        for name, begin, end, _ in background:
+            lines.append(f"{name:<40}{begin:>11.3f}{end - begin:>11.3f}")
+
+    if imports:
+        lines.append("")
+        lines.append(f"Импорты верхнего уровня, включая процессы отрисовки (всего {sum(i[2] for i in imports if i[3] == 0):.3f} с):")
+        for name, _, cumulative, _ in sorted((i for i in imports if i[3] == 0), key=lambda i: -i[2])[:top]:
+            lines.append(f"  {name:<50}{cumulative * 1000:>9.1f} мс")
+        lines.append("Самые долгие модули (собственное время без вложенных импортов):")
+        for name, own, _, _ in sorted(imports, key=lambda i: -i[1])[:top]:
+            lines.append(f"  {name:<50}{own * 1000:>9.1f} мс")
+    return "\n".join(lines)
+
+
+def profile_startup(script: str) -> int:
+    """Запускает script с -X importtime в режиме профиля и печатает отчёт. Возвращает код завершения"""
+    env = dict(os.environ)
+    env[START_TIME_ENV] = repr(time.time())
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", script, PROFILE_FLAG],
+        env=env, capture_output=True, text=True
+    )
+    phases = None
+    for line in result.stdout.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            phases = json.loads(line[len(REPORT_PREFIX):])
+    if phases is None:
+        sys.stderr.write(result.stderr)
+        print("Бот завершился, не закончив запуск", file=sys.stderr)
+        return result.returncode or 1
+    print(format_report(phases, _parse_imports(result.stderr)))
+    return 0
@@ -0,0 +1,89 @@
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RecentKeys:
+    """Ключи, встреченные за последние ttl_seconds; не больше max_entries, при переполнении вытесняются самые старые.
+    Срок жизни у всех ключей одинаковый, поэтому порядок добавления совпадает с порядком истечения"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 100_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._expires = OrderedDict()
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._expires)
+
+    def _expire(self, now: float):
+        while self._expires:
+            key, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            del self._expires[key]
+
+    def seen(self, key) -> bool:
+        """True, если ключ уже встречался за ttl_seconds; иначе ключ запоминается и возвращается False"""
+        now = time.monotonic()
+        self._expire(now)
+        if key in self._expires:
+            self.hits += 1
+            return True
+        self._expires[key] = now + self.ttl_seconds
+        if len(self._expires) > self.max_entries:
+            self._expires.popitem(last=False)
+            self.evictions += 1
+        return False
+
+
+class DedupMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: повторы отбрасываются до фильтров и обработчиков.
+
+    Повтор - обновление с уже обработанным update_id (повторная доставка вебхука, повтор пачки getUpdates)
+    или двойное нажатие кнопки, меняющей данные (префиксы callback_prefixes: запись настроения, часовой пояс):
+    та же кнопка той же версии сообщения тем же пользователем за callback_ttl секунд. Версия сообщения -
+    его edit_date, поэтому повторное нажатие на отредактированном сообщении (листание истории туда и обратно)
+    обрабатывается как обычно. Повтор не добавляет вторую запись настроения, не увеличивает версию данных
+    месяца и не сбрасывает закэшированные графики. Ключ запоминается до обработки: повтор, пришедший,
+    пока первое обновление ещё обрабатывается, тоже отбрасывается.
+    """
+
+    def __init__(self, update_ttl: float = 600, callback_ttl: float = 10, max_entries: int = 100_000,
+                 callback_prefixes: tuple = ("mood", "timezone"), registry=metrics):
+        self.updates = RecentKeys(update_ttl, max_entries)
+        self.callbacks = RecentKeys(callback_ttl, max_entries)
+        self.callback_prefixes = frozenset(callback_prefixes)
+        self.registry = registry
+
+    async def __call__(self, handler, event: Update, data):
+        if self.updates.seen(event.update_id):
+            self.registry.inc("duplicate_updates", key="update_id")
+            logger.info(f"Повтор обновления {event.update_id} пропущен")
+            return None
+
+        callback = event.callback_query
+        if callback is not None and callback.data and callback.data.partition("_")[0] in self.callback_prefixes:
+            message = callback.message
+            if message is not None:
+                key = (callback.from_user.id, message.message_id, getattr(message, "edit_date", None), callback.data)
+            else:
+                key = (callback.from_user.id, callback.inline_message_id, None, callback.data)
+            if self.callbacks.seen(key):
+                self.registry.inc("duplicate_updates", key="callback")
+                # У второго нажатия свой колбэк: без ответа на кнопке будут крутиться часики
+                try:
+                    await callback.answer()
+                except TelegramAPIError:
+                    pass
+                return None
+        return await handler(event, data)
@@ -0,0 +1,81 @@
+from add_mood_to_db import (
+    add_user_notification,
+    clear_time_notification,
+    get_user_settings,
+    update_time_notification,
+    update_time_zone,
+)
+from reminders import shift_time_str
+from session_cache import UserSession
+
+
+def parse_time_zone(time_zone):
+    """Смещение относительно МСК из таблицы users (2 или '+2' из старых баз) -> целое число, None -> None"""
+    if time_zone is None or time_zone == "":
+        return None
+    return int(time_zone)
+
+
+def local_notification_time(session: UserSession):
+    """Время напоминания по местному времени пользователя для показа в сообщениях"""
+    if not session.notification_time:
+        return None
+    return shift_time_str(session.notification_time, session.tz_offset or 0)
+
+
+class UserSettingsRepository:
+    """Настройки пользователей (время напоминания и часовой пояс) с кэшем со сквозной записью.
+
+    Чтение - поиск по первичному ключу в users, результат остаётся в кэше сессий.
+    Любое изменение сначала пишется в базу, затем в кэш, поэтому кэш не расходится с таблицей.
+    """
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+
+    async def get(self, user_id: int) -> UserSession:
+        session = self.cache.get(user_id)
+        if session is not None:
+            return session
+        row = await self.db.read(get_user_settings, user_id)
+        if row is None:
+            session = UserSession()
+        else:
+            notification_time, time_zone = row
+            session = UserSession(known=True, notification_time=notification_time, tz_offset=parse_time_zone(time_zone))
+        return self.cache.put(user_id, session)
+
+    async def set_notification_time(self, user_id: int, notification_time: str):
+        """Сохраняет время напоминания (по Москве)"""
+        session = await self.get(user_id)
+        if session.known:
+            await self.db.write(update_time_notification, user_id, notification_time)
+        else:
+            await self.db.write(add_user_notification, user_id=user_id, time=notification_time, time_zone=session.tz_offset)
+            session.known = True
+        session.notification_time = notification_time
+
+    async def set_time_zone(self, user_id: int, offset: int):
+        """Сохраняет часовой пояс. Если напоминание уже настроено, сдвигает его время по Москве так,
+        чтобы по местному времени оно осталось прежним. Возвращает новое время напоминания или None"""
+        session = await self.get(user_id)
+        new_time = None
+        if session.known:
+            await self.db.write(update_time_zone, user_id, offset)
+            old_offset = session.tz_offset or 0
+            if session.notification_time and offset != old_offset:
+                new_time = shift_time_str(session.notification_time, old_offset - offset)
+                await self.db.write(update_time_notification, user_id, new_time)
+                session.notification_time = new_time
+        else:
+            await self.db.write(add_user_notification, user_id=user_id, time=None, time_zone=offset)
+            session.known = True
+        session.tz_offset = offset
+        return new_time
+
+    async def clear_notification(self, user_id: int):
+        await self.db.write(clear_time_notification, user_id)
+        session = self.cache.get(user_id)
+        if session is not None:
+            session.notification_time = None
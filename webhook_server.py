@@ -0,0 +1,138 @@
+import asyncio
+import ipaddress
+import logging
+import secrets
+import time
+
+from aiohttp import web
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookServer:
+    """Приём обновлений от Telegram через вебхук на aiohttp вместо long polling.
+
+    На каждый POST на path сервер сразу отвечает 200, а обновление обрабатывается отдельной задачей,
+    поэтому медленный обработчик не задерживает ответ Telegram и не мешает другим обновлениям.
+    С background=False ответ отправляется после feed: при ошибке - 503, и Telegram доставит обновление повторно.
+    Запросы без верного заголовка X-Telegram-Bot-Api-Secret-Token отклоняются. Без secret_token сервер
+    запускается только на loopback-адресе: иначе любой, кто достучится до порта, сможет прислать поддельное
+    обновление от имени любого пользователя.
+    GET /healthz отвечает 200, пока сервер принимает обновления, и 503 во время остановки - для балансировщика.
+
+    Для проверки без Telegram достаточно пустого url и POST с JSON обновления:
+        curl -H "X-Telegram-Bot-Api-Secret-Token: <secret>" -d '{"update_id": 1, "message": {...}}' http://127.0.0.1:8080/webhook
+    """
+
+    def __init__(self, feed, bot, host: str = "0.0.0.0", port: int = 8080, path: str = "/webhook",
+                 secret_token: str = "", url: str = "", drain_timeout: float = 30,
+                 allowed_updates: list = None, background: bool = True):
+        # feed(update) - корутина, обрабатывающая обновление (словарь из JSON запроса).
+        # url - внешний адрес (https://example.com), по которому Telegram будет присылать обновления;
+        # пустой url - вебхук в Telegram не регистрируется, обновления можно присылать вручную
+        if not secret_token and not is_loopback(host):
+            raise ValueError(f"Вебхук на {host} без secret_token: задайте WEBHOOK_SECRET или слушайте 127.0.0.1")
+        self.feed = feed
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.url = url
+        self.drain_timeout = drain_timeout
+        self.allowed_updates = allowed_updates
+        self.background = background
+
+        self._runner = None
+        self._tasks = set()
+        self._closing = False
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+        if self.url:
+            await self.bot.set_webhook(
+                self.url.rstrip("/") + self.path,
+                secret_token=self.secret_token or None,
+                allowed_updates=self.allowed_updates,
+            )
+            logger.info(f"Вебхук зарегистрирован в Telegram: {self.url.rstrip('/')}{self.path}")
+
+    async def _handle_update(self, request):
+        if self.secret_token and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self._closing:
+            # Telegram повторит доставку позже, балансировщик - отправит на другой экземпляр
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+
+        self.received += 1
+        if not self.background:
+            try:
+                await self.feed(update)
+            except Exception as e:
+                logger.warning(f"Обновление {update.get('update_id')} не обработано: {e}")
+                return web.Response(status=503)
+            return web.Response()
+
+        task = asyncio.create_task(self._feed_update(update, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _feed_update(self, update: dict, received_at: float):
+        # Ошибки обработчиков уже записаны в лог диспетчером; задача не должна падать молча
+        try:
+            await self.feed(update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+        finally:
+            metrics.observe("webhook_update_seconds", time.monotonic() - received_at)
+
+    async def _handle_health(self, request):
+        return web.Response(status=503 if self._closing else 200, text="closing" if self._closing else "ok")
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def stop(self):
+        """Перестаёт принимать обновления и дожидается уже начатых обработчиков (не дольше drain_timeout).
+        Вебхук в Telegram не удаляется: обновления, пришедшие во время перезапуска, будут доставлены повторно"""
+        self._closing = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._tasks:
+            logger.info(f"Ожидание обработки {len(self._tasks)} обновлений перед остановкой")
+            done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Не дождались {len(pending)} обработчиков за {self.drain_timeout} с, они отменены")
+        await self.bot.session.close()